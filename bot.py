@@ -1,3 +1,8 @@
+import time
+
+# 启动时间戳，供 manager_plugin 的启动耗时报告计算 boot-to-ready（每个进程各自记录，不经环境变量传给子进程）
+BOOT_TIME = time.time()
+
 import nonebot
 from nonebot.adapters.qq import Adapter as QQAdapter
 
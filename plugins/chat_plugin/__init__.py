@@ -2,17 +2,32 @@
 # fmt: off
 from __future__ import annotations
 
+import asyncio
 import time
+_import_started = time.perf_counter()
+
+from collections.abc import Awaitable, Callable
+from functools import partial
 from typing import TypedDict, TypeGuard, cast
 
-from nonebot import on_message
+from nonebot import get_driver, on_message, require
 from nonebot.adapters import Bot as BaseBot, Event
-from nonebot.exception import FinishedException
-from nonebot.internal.matcher import Matcher
 from nonebot.log import logger
+from nonebot.typing import T_State
+
+_ = require("manager_plugin")
+from ..manager_plugin.config import get_config as get_manager_config  # noqa: E402
+from ..manager_plugin.dispatcher import dispatcher  # noqa: E402
+from ..manager_plugin.fastlog import fastlog  # noqa: E402
+from ..manager_plugin.memstat import format_bytes  # noqa: E402
+from ..manager_plugin.parsed import ParsedMessage, get_parsed_message  # noqa: E402
+from ..manager_plugin.profiler import startup_profiler  # noqa: E402
+from ..manager_plugin.shard import set_shard_key  # noqa: E402
 
 from .config import ChatConfig
-from .processor import ChatProcessor
+from .context import SCOPE_USER, context_key
+from .nickname import NicknameMatcher
+from .processor import ChatProcessor, ProcessorClosedError, QuotaExceededError, get_group_id
 
 # ---------- 运行时适配器类（模块级，避免函数内重复 import） ----------
 try:
@@ -88,17 +103,82 @@ except Exception as e:
     logger.error(f"聊天插件配置加载失败: {e}")
 
 nicknames: list[str] = plugin_config.nickname if plugin_config else ["猫猫"]
+nickname_matcher: NicknameMatcher = (
+    NicknameMatcher.from_config(plugin_config) if plugin_config else NicknameMatcher(nicknames)
+)
 logger.info(f"Using nicknames: {nicknames}")
 
+driver = get_driver()
+
+# 处理器在 driver 启动后再构建，不拖慢插件导入
 chat_processor: ChatProcessor | None = None
-if plugin_config:
+
+
+def shard_key(event: Event) -> str | None:
+    """多 worker 分片键：与上下文归属一致，同一上下文总由同一个 worker 处理"""
+    try:
+        user_id = event.get_user_id()
+    except (ValueError, NotImplementedError):
+        return None
+    scope = plugin_config.context_scope if plugin_config else SCOPE_USER
+    return context_key(scope, user_id, get_group_id(event))
+
+
+set_shard_key(shard_key)
+
+
+def create_processor(config: ChatConfig) -> ChatProcessor:
+    manager_config = get_manager_config()
+    processor = ChatProcessor(
+        config, manager_config.worker_id, manager_config.worker_count, manager_config.shard_bots is None
+    )
+    restored = processor.load_state()
+    processor.start()
+    logger.info(f"Chat processor initialized (worker {processor.worker_id}/{processor.worker_count}), restored {restored} context(s)")
+    return processor
+
+
+@driver.on_startup
+async def init_processor() -> None:
+    global chat_processor
+    if not plugin_config:
+        return
     try:
-        chat_processor = ChatProcessor(plugin_config)
-        logger.info(f"Chat processor initialized: {bool(chat_processor)}")
+        with startup_profiler.measure("chat_plugin", "init"):
+            chat_processor = create_processor(plugin_config)
     except Exception as e:
         logger.error(f"聊天处理器初始化失败: {e}")
 
 
+def reload_config(source: dict[str, object] | None = None) -> str:
+    """重新加载聊天配置并切换到运行中的处理器，队列与上下文不受影响
+
+    新配置和昵称匹配器全部构建成功后才一次性替换（中间没有 await），校验失败时保留旧配置
+    """
+    global plugin_config, nicknames, nickname_matcher, chat_processor
+    new_config = ChatConfig.from_env(source)
+    new_matcher = NicknameMatcher.from_config(new_config)
+    plugin_config, nicknames, nickname_matcher = new_config, new_config.nickname, new_matcher
+    if chat_processor is None:
+        # 启动时初始化失败（例如配置有误），修正后在这里补建
+        chat_processor = create_processor(new_config)
+        return "聊天处理器已初始化"
+    changed = chat_processor.apply_config(new_config)
+    logger.info(f"聊天配置已重新加载，变更项: {changed or '无'}")
+    return f"聊天配置变更: {', '.join(changed)}" if changed else "聊天配置无变化"
+
+
+@driver.on_shutdown
+async def shutdown_processor() -> None:
+    """停止接收新消息，等待进行中的请求完成后保存状态"""
+    if chat_processor is None:
+        return
+    try:
+        await chat_processor.shutdown()
+    except Exception as e:
+        logger.error(f"聊天处理器关闭失败: {e}")
+
+
 # ---------- 协议检测函数 ----------
 def get_bot_type(bot: BaseBot) -> str:
     """检测机器人类型"""
@@ -120,91 +200,51 @@ def get_user_id(_bot: BaseBot, event: Event, bot_type: str) -> str:
     return event.get_user_id()
 
 
-def get_plain_text(event: Event, bot_type: str) -> str:
-    """统一获取纯文本内容"""
-    if bot_type == "qq_official" and _QQMsgEventCls is not None:
-        if isinstance(event, _QQMsgEventCls):
-            return str(event.get_plaintext())
-    elif bot_type == "onebot_v11" and _OB11MsgEventCls is not None:
-        if isinstance(event, _OB11MsgEventCls):
-            return str(event.get_plaintext())
-    return str(event.get_plaintext())
-
-
-def _seg_data_get(seg: object, key: str) -> object:
-    """安全地从消息段的 data 字典中取值，消除 seg.data.get() 的类型未知问题"""
-    raw_data = getattr(seg, "data", {})
-    if not isinstance(raw_data, dict):
-        return None
-    d = cast(dict[str, object], raw_data)
-    return d.get(key)
-
+def match_nickname(parsed: ParsedMessage) -> str | None:
+    """查找消息中命中的昵称，每个事件只匹配一次"""
+    if not parsed.nickname_checked:
+        parsed.nickname_checked = True
+        hit = nickname_matcher.search(parsed.plaintext)
+        if hit is not None:
+            parsed.nickname = hit.text
+            parsed.nickname_span = (hit.start, hit.end)
+    return parsed.nickname
 
-def is_mentioned(bot: BaseBot, event: Event, bot_type: str, message_text: str) -> bool:
-    """检查是否@了机器人 或 提到了机器人昵称"""
-    bot_id = bot.self_id
 
-    if bot_type == "qq_official" and _QQMsgEventCls is not None:
-        if isinstance(event, _QQMsgEventCls):
-            for seg in event.get_message():
-                seg_type: object = getattr(seg, "type", None)
-                if seg_type == "mention" and _seg_data_get(seg, "user_id") == bot_id:
-                    logger.debug("Triggered by @mention (QQ official)")
-                    return True
+def is_mentioned(parsed: ParsedMessage) -> bool:
+    """检查是否@了机器人 或 提到了机器人昵称（昵称结果缓存在 parsed 上）"""
+    if parsed.at_bot:
+        fastlog.debug("mention", "Triggered by @mention")
+        return True
 
-    elif bot_type == "onebot_v11" and _OB11MsgEventCls is not None:
-        if isinstance(event, _OB11MsgEventCls):
-            for seg in event.get_message():
-                seg_type = getattr(seg, "type", None)
-                if seg_type == "at" and _seg_data_get(seg, "qq") == bot_id:
-                    logger.debug("Triggered by @mention (OneBot V11)")
-                    return True
-
-    if f"[CQ:at,qq={bot_id}]" in message_text:
-        logger.debug("Triggered by @mention CQ code")
+    if parsed.cq_at_bot:
+        fastlog.debug("mention", "Triggered by @mention CQ code")
         return True
 
-    for nickname in nicknames:
-        if nickname in message_text:
-            logger.debug(f"Triggered by nickname: {nickname}")
-            return True
+    if match_nickname(parsed) is not None:
+        fastlog.debug("mention", "Triggered by nickname: {nickname}", nickname=parsed.nickname)
+        return True
 
-    if bot_type == "onebot_v11" and _OB11MsgEventCls is not None:
-        if isinstance(event, _OB11MsgEventCls):
-            if getattr(event, "message_type", None) == "private":
-                logger.debug("Triggered by private message (OneBot V11)")
-                return True
+    if parsed.is_private:
+        fastlog.debug("mention", "Triggered by private message")
+        return True
 
     return False
 
 
-def extract_actual_message(
-    bot: BaseBot, event: Event, bot_type: str, message_text: str
-) -> str:
-    """提取去除@和昵称后的实际消息内容"""
-    result = message_text
-    bot_id = bot.self_id
+def extract_actual_message(parsed: ParsedMessage) -> str:
+    """提取去除@和昵称后的实际消息内容（@ 段不计入纯文本，只需去掉昵称）"""
+    if parsed.actual_text is not None:
+        return parsed.actual_text
 
-    if bot_type == "onebot_v11" and _OB11MsgEventCls is not None:
-        if isinstance(event, _OB11MsgEventCls):
-            parts: list[str] = []
-            for seg in event.get_message():
-                seg_type: object = getattr(seg, "type", None)
-                # bool() 包裹确保 is_at_bot 类型为 bool，消除 reportUnknownVariableType
-                is_at_bot = bool(
-                    seg_type == "at" and _seg_data_get(seg, "qq") == bot_id
-                )
-                if seg_type == "text" and not is_at_bot:
-                    parts.append(str(seg))
-            if parts:
-                result = "".join(parts)
-
-    for nickname in nicknames:
-        if nickname in result:
-            result = result.replace(nickname, "", 1).strip()
-            break
-
-    return result.strip() or message_text
+    result = parsed.plaintext
+    _ = match_nickname(parsed)
+    if parsed.nickname_span is not None:
+        start, end = parsed.nickname_span
+        result = result[:start] + result[end:]
+
+    parsed.actual_text = result.strip() or parsed.plaintext
+    return parsed.actual_text
 
 
 async def delete_message(bot: BaseBot, message_id: str | int) -> bool:
@@ -224,33 +264,139 @@ async def delete_message(bot: BaseBot, message_id: str | int) -> bool:
         logger.debug(f"Failed to delete message: {e}")
     return False
 
+async def send_thinking(
+    bot: BaseBot, event: Event, bot_type: str, job: asyncio.Future[str]
+) -> object:
+    """回复超过阈值仍未就绪时发送占位消息，返回发送结果；未发送返回 None"""
+    if plugin_config is None or plugin_config.thinking_threshold_ms <= 0:
+        return None
+    # 只在能撤回的协议端发送，避免占位消息残留
+    if bot_type != "onebot_v11":
+        return None
+    done, _ = await asyncio.wait({job}, timeout=plugin_config.thinking_threshold_ms / 1000)
+    if done:
+        return None
+    # 经由出站调度器发送，占位消息同样计入限速；发送失败时结果为空
+    results = await dispatcher.send(bot, event, plugin_config.thinking_text)
+    return results[0] if results else None
+
+
 def get_context_count() -> int:
-    """返回当前有历史记录的用户数"""
+    """返回当前有历史记录的上下文数（按用户模式下即用户数）；多 worker 时为全集群合计"""
     if chat_processor is None:
         return 0
-    return sum(
-        1 for uq in chat_processor.user_queues.values()
-        if uq.history
+    return sum(stats.get("contexts", 0) for stats in chat_processor.cluster_stats().values())
+
+
+def get_cluster_summary() -> str:
+    """多 worker 运行概况，单进程时返回空字符串"""
+    if chat_processor is None or chat_processor.worker_count <= 1:
+        return ""
+    workers = chat_processor.cluster_stats()
+    queued = sum(stats.get("queued", 0) for stats in workers.values())
+    in_flight = sum(stats.get("in_flight", 0) for stats in workers.values())
+    return (
+        f"worker {chat_processor.worker_id}，在线 {len(workers)}/{chat_processor.worker_count}，"
+        f"排队 {queued}，进行中 {in_flight}"
     )
 
 
-def clear_context(user_id: str | None = None) -> int:
-    """清除上下文，返回清除的用户数。user_id=None 时清除所有"""
+async def clear_context(user_id: str | None = None) -> int:
+    """清除上下文，返回清除的上下文数。user_id 也可以是群号；为 None 时清除所有"""
     if chat_processor is None:
         return 0
-    if user_id is not None:
-        uq = chat_processor.user_queues.get(user_id)
-        if uq:
-            uq.history.clear()
-            return 1
-        return 0
-    count = sum(1 for uq in chat_processor.user_queues.values() if uq.history)
-    for uq in chat_processor.user_queues.values():
-        uq.history.clear()
-    return count
+    return await chat_processor.clear_history(user_id)
 
 
 
+def get_usage_report(limit: int = 10) -> str:
+    """当日 token 用量报告：按模型汇总，以及用量最多的用户和群"""
+    if chat_processor is None:
+        return "chat_plugin 未初始化"
+    usage = chat_processor.usage
+    lines: list[str] = [f"Token 用量 ({usage.day})"]
+    for model, (prompt, completion, requests) in sorted(usage.by_model().items()):
+        lines.append(f"   • {model}: 输入 {prompt} / 输出 {completion} ({requests} 次)")
+    for scope, title in (("user", "用户"), ("group", "群聊")):
+        top = usage.top(scope, limit)
+        if top:
+            lines.append(f"• {title} Top {len(top)}")
+            lines.extend(f"   • {scope_id}: {total}" for scope_id, total in top)
+    if len(lines) == 1:
+        lines.append("   • 暂无记录")
+    return "\n".join(lines)
+
+
+def get_scheduler_report(limit: int = 5) -> str:
+    """调度器实时状态：并发名额、排队最多的队列、进行中的上游调用与缓存命中率"""
+    if chat_processor is None:
+        return "chat_plugin 未初始化"
+    processor = chat_processor
+    sched, limiter = processor.sched, processor.limiter
+    lines: list[str] = [
+        "调度器状态",
+        f"• 并发: 使用 {limiter.in_use}/{limiter.limit}，等待名额 {limiter.waiting}",
+        f"• 排队任务: {sched.queued}（{len(sched.waiting)} 个队列）",
+    ]
+    lines.extend(
+        f"   • {qkey}: {depth} 条，最久等待 {age:.1f}s"
+        for qkey, depth, age in sched.top_queues(limit)
+    )
+    lines.append(f"• 进行中的请求: {len(sched.in_flight)}")
+    lines.extend(
+        f"   • {user_id} ({model}): {elapsed:.1f}s"
+        for user_id, model, elapsed in sched.longest_calls(limit)
+    )
+    if sched.completed_calls:
+        lines.append(f"• 平均请求耗时: {sched.call_time / sched.completed_calls:.2f}s（{sched.completed_calls} 次）")
+    if processor.semantic_cache is not None:
+        stats = processor.semantic_cache.stats()
+        lines.append(
+            f"• 语义缓存: 命中率 {cast(float, stats['hit_rate']):.1%}"
+            f"（{stats['hits']}/{cast(int, stats['hits']) + cast(int, stats['misses'])}），"
+            f"平均查询 {cast(float, stats['avg_lookup_ms']):.2f}ms"
+        )
+    lookups = cast(int, processor.metrics.get("memory_lookups", 0))
+    if lookups:
+        lookup_time = cast(float, processor.metrics.get("memory_lookup_time", 0.0))
+        lines.append(f"• 长期记忆: 检索 {lookups} 次，平均 {lookup_time / lookups * 1000:.2f}ms")
+    lines.append(f"• 待发送消息: {dispatcher.pending}")
+    return "\n".join(lines)
+
+
+MEMORY_LABELS: dict[str, str] = {
+    "history": "上下文",
+    "queues": "任务队列",
+    "group_buffers": "群聊缓冲",
+    "semantic_cache": "语义缓存",
+    "long_term_memory": "长期记忆",
+    "usage": "用量统计",
+    "scheduler": "调度统计",
+}
+
+
+def get_memory_report(limit: int = 5) -> str:
+    """各子系统内存占用估算，以及占用最大的上下文"""
+    if chat_processor is None:
+        return "chat_plugin 未初始化"
+    processor = chat_processor
+    usage = processor.memory_usage()
+    turns = sum(len(history) for history in processor.histories.values())
+    details = {
+        "history": f"（{len(processor.histories)} 个上下文，{turns} 条消息）",
+        "queues": f"（{len(processor.user_queues)} 个队列，{processor.sched.queued} 个待处理任务）",
+        "group_buffers": f"（{len(processor.group_buffers)} 个群）",
+    }
+    lines: list[str] = [f"聊天插件内存（估算）: {format_bytes(sum(usage.values()))}"]
+    lines.extend(
+        f"   • {MEMORY_LABELS.get(name, name)}: {format_bytes(size)}{details.get(name, '')}"
+        for name, size in usage.items()
+    )
+    top = processor.top_contexts(limit)
+    if top:
+        lines.append(f"• 占用最大的 {len(top)} 个上下文")
+        lines.extend(f"   • {ckey}: {format_bytes(size)}（{count} 条）" for ckey, count, size in top)
+    return "\n".join(lines)
 
 
 # ---------- 消息处理入口 ----------
@@ -258,30 +404,38 @@ def clear_context(user_id: str | None = None) -> int:
 async def handle_chat(
     bot: BaseBot,
     event: Event,
-    matcher: Matcher,
+    state: T_State,
 ) -> None:
     """处理聊天消息（兼容 QQ 官方和 OneBot V11）"""
     bot_type = get_bot_type(bot)
     if bot_type == "unknown":
-        logger.debug(f"Skipped: unknown bot type {type(bot)}")
+        fastlog.debug("chat", "Skipped: unknown bot type {bot_type}", bot_type=type(bot).__name__)
         return
 
     if event.get_user_id() == bot.self_id:
         return
 
+    parsed = get_parsed_message(bot, event, state)
+    if parsed is None:
+        return
+
     user_id = get_user_id(bot, event, bot_type)
-    message_text = get_plain_text(event, bot_type)
+    message_text = parsed.plaintext
 
-    if message_text.strip().startswith("/"):
-        logger.debug(f"Ignored command: {message_text}")
+    if parsed.stripped.startswith("/"):
+        fastlog.debug("chat", "Ignored command: {text}", text=message_text)
         return
 
-    if not is_mentioned(bot, event, bot_type, message_text):
-        logger.debug(f"Skipped: not mentioned by user {user_id}")
+    if not is_mentioned(parsed):
+        if chat_processor is not None:
+            chat_processor.observe(event, user_id, message_text)
+        fastlog.debug("chat", "Skipped: not mentioned by user {user_id}", user_id=user_id)
         return
 
-    actual_message = extract_actual_message(bot, event, bot_type, message_text) or "你好呀"
-    logger.info(f"Processing from {user_id}: '{actual_message}' (original: '{message_text}')")
+    actual_message = extract_actual_message(parsed) or "你好呀"
+    # 消息正文只在 debug 级别记录
+    fastlog.info("chat", "Processing from {user_id} ({chars} chars)", user_id=user_id, chars=len(actual_message))
+    fastlog.debug("chat", "Message from {user_id}: '{text}'", user_id=user_id, text=actual_message)
 
     if not plugin_config or not chat_processor:
         logger.info("Skipped: plugin not initialized")
@@ -292,24 +446,47 @@ async def handle_chat(
         return
 
     thinking_msg: object = None
+    reply: str | None = None
     try:
         start_time = time.time()
-        response = await chat_processor.process_message(actual_message, user_id, bot, event)
-        logger.info(f"Chat processed in {time.time() - start_time:.2f}s for user {user_id}")
-
-        if is_send_response(thinking_msg):
-            _ = await delete_message(bot, thinking_msg["message_id"])
-
+        job = asyncio.ensure_future(
+            chat_processor.process_message(actual_message, user_id, bot, event)
+        )
+        thinking_msg = await send_thinking(bot, event, bot_type, job)
+        response = await job
+        fastlog.info(
+            "chat", "Chat processed in {elapsed:.2f}s for user {user_id}",
+            elapsed=time.time() - start_time, user_id=user_id,
+        )
         if response and response.strip():
-            await matcher.finish(response)  # pyright: ignore[reportUnknownMemberType]
-
-    except FinishedException:
-        raise
+            reply = response
+    except QuotaExceededError as e:
+        logger.info(f"Rejected chat from {user_id}: {e}")
+        reply = "喵…今天聊得太多啦，明天再来找诺喵莉吧~"
+    except ProcessorClosedError:
+        logger.info(f"Rejected chat from {user_id}: processor shutting down")
+        reply = "喵…诺喵莉要去休息一下，稍后再来找我吧~"
     except Exception as e:
         logger.error(f"Chat plugin error: {e}")
-        try:
-            await matcher.finish("喵…诺喵莉刚才走神了，能再说一遍吗？(>_<)")  # pyright: ignore[reportUnknownMemberType]
-        except Exception:
-            pass
-
-__all__: list[str] = ["get_context_count", "clear_context"]
+        reply = "喵…诺喵莉刚才走神了，能再说一遍吗？(>_<)"
+
+    # 正式回复（或错误提示）交给出站调度器后立即返回，发完后再撤回占位消息
+    recall: Callable[[], Awaitable[bool]] | None = None
+    if is_send_response(thinking_msg):
+        recall = partial(delete_message, bot, thinking_msg["message_id"])
+    if reply is not None:
+        _ = dispatcher.submit(bot, event, reply, after=recall)
+    elif recall is not None:
+        _ = await recall()
+
+startup_profiler.record("chat_plugin", "import", time.perf_counter() - _import_started)
+
+__all__: list[str] = [
+    "get_context_count",
+    "get_cluster_summary",
+    "clear_context",
+    "get_memory_report",
+    "get_scheduler_report",
+    "get_usage_report",
+    "reload_config",
+]
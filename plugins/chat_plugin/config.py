@@ -5,10 +5,13 @@ import json
 import os
 from typing import ClassVar, cast
 
-from pydantic import BaseModel, ConfigDict, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, ValidationInfo, field_validator
 from nonebot import get_driver
 from nonebot.log import logger
 
+from .context import CONTEXT_SCOPES
+from .routing import RouteRule
+
 
 class ChatConfig(BaseModel):
     """聊天插件配置（自动从 NoneBot 全局配置加载）"""
@@ -22,9 +25,32 @@ class ChatConfig(BaseModel):
     timeout: int = Field(default=30)
     max_concurrent: int = Field(default=5) # 最大并发请求数
     max_history: int = Field(default=10) # 最大上下文数量
-    storage_backend: str = Field(default="memory") # 存储上下文的方法，"memory"则表示使用内存存储
+    context_scope: str = Field(default="user") # 上下文范围："user" 按用户，"group" 群内共享，"user_in_group" 群内按用户
+    group_buffer_tokens: int = Field(default=800) # 群共享模式下最近群消息缓冲区的 token 预算，0 为关闭
+    group_buffer_size: int = Field(default=50) # 群消息缓冲区最多保留的条数
+    storage_backend: str = Field(default="memory") # 存储上下文的方法："memory" 内存（关闭时写入 JSON），"sqlite" 多 worker 共享的 SQLite
+    data_dir: str = Field(default="data/chat_plugin") # 关闭时保存上下文与指标的目录
+    shutdown_timeout: float = Field(default=10.0) # 关闭时等待进行中请求的最长秒数
+    daily_user_token_quota: int = Field(default=0) # 每个用户每日 token 配额，0 为不限
+    daily_group_token_quota: int = Field(default=0) # 每个群每日 token 配额，0 为不限
+    usage_flush_interval: int = Field(default=60) # 用量落盘间隔（秒）
+    long_term_memory: bool = Field(default=False) # 长期记忆（需要 numpy）
+    memory_top_k: int = Field(default=3) # 每次检索放入提示词的旧对话条数
+    memory_min_score: float = Field(default=0.3) # 检索结果的最低相似度
+    memory_max_items: int = Field(default=50000) # 长期记忆最多保存的条数，超出时淘汰最旧的
+    semantic_cache: bool = Field(default=False) # 语义近似回复缓存（需要 numpy）
+    semantic_cache_threshold: float = Field(default=0.95) # 命中所需的最低余弦相似度（字符 n-gram 向量，已忽略标点与句末语气词；调低易误命中）
+    semantic_cache_size: int = Field(default=1024) # 每个 (系统提示词, 模型) 分区缓存的提问数
+    semantic_cache_max_history: int = Field(default=0) # 仅对上下文不超过该轮数的提问使用缓存
+    embedding_dim: int = Field(default=256) # 本地哈希向量维度（长期记忆与语义缓存共用）
+    routes: list[RouteRule] = Field(default_factory=list) # 模型路由规则，按顺序匹配
+    user_tiers: dict[str, str] = Field(default_factory=dict) # 用户等级，QQ号 -> 等级名
+    thinking_threshold_ms: int = Field(default=0) # 超过该毫秒数仍未回复则发送占位消息，0 为关闭
+    thinking_text: str = Field(default="思考中喵…") # 占位消息内容，回复发出后撤回
     system_prompt: str = Field(default="你是一位有用的AI")
     nickname: list[str] = Field(default=["猫猫"])
+    nickname_aliases: list[str] = Field(default_factory=list) # 昵称别名，与 nickname 等价
+    trigger_patterns: list[str] = Field(default_factory=list) # 正则触发词
     # fmt: on
     model_config: ClassVar[ConfigDict] = ConfigDict(extra="ignore")
 
@@ -47,6 +73,56 @@ class ChatConfig(BaseModel):
                 pass
         return [v_stripped]
 
+    @field_validator("nickname_aliases", "trigger_patterns", mode="before")
+    @classmethod
+    def parse_str_list(cls, v: str | list[str] | set[str] | None) -> list[str]:
+        """解析字符串列表（支持 JSON 数组、普通字符串或集合），未设置时为空列表"""
+        if v is None:
+            return []
+        if isinstance(v, (list, set)):
+            return [str(item) for item in v]
+        v_stripped = v.strip()
+        if v_stripped.startswith("[") and v_stripped.endswith("]"):
+            try:
+                parsed = cast(list[object], json.loads(v_stripped))
+                return [str(item) for item in parsed]
+            except json.JSONDecodeError:
+                pass
+        return [v_stripped] if v_stripped else []
+
+    @field_validator("routes", "user_tiers", mode="before")
+    @classmethod
+    def parse_json_value(cls, v: object, info: ValidationInfo) -> object:
+        """环境变量中的路由规则与用户等级以 JSON 字符串给出，解析失败时使用空值"""
+        empty: object = [] if info.field_name == "routes" else {}
+        if v is None:
+            return empty
+        if isinstance(v, str):
+            try:
+                return cast(object, json.loads(v))
+            except json.JSONDecodeError:
+                logger.warning(f"解析 {info.field_name} 失败: {v}，将使用默认值")
+                return empty
+        return v
+
+    @field_validator("context_scope", mode="before")
+    @classmethod
+    def check_context_scope(cls, v: object) -> str:
+        scope = str(v).strip().lower() if v is not None else "user"
+        if scope not in CONTEXT_SCOPES:
+            logger.warning(f"未知的 context_scope: {v}，将使用 user")
+            return "user"
+        return scope
+
+    @field_validator("storage_backend", mode="before")
+    @classmethod
+    def check_storage_backend(cls, v: object) -> str:
+        backend = str(v).strip().lower() if v is not None else "memory"
+        if backend not in ("memory", "sqlite"):
+            logger.warning(f"未知的 storage_backend: {v}，将使用 memory")
+            return "memory"
+        return backend
+
     @field_validator("system_prompt", mode="before")
     @classmethod
     def fallback_system_prompt(cls, v: str | None) -> str:
@@ -60,9 +136,8 @@ class ChatConfig(BaseModel):
         return "你是一位有用的AI"
 
     @classmethod
-    def from_env(cls) -> ChatConfig:
-        """从 NoneBot 全局配置创建实例（自动加载 .env 文件）"""
-        global_config = get_driver().config
-        dumped = global_config.model_dump()
+    def from_env(cls, source: dict[str, object] | None = None) -> ChatConfig:
+        """从 NoneBot 全局配置创建实例（自动加载 .env 文件）；source 为重新读取的全局配置"""
+        dumped = source if source is not None else get_driver().config.model_dump()
         chat_data = cast(dict[str, object], dumped.get("chat", {}))
         return cls.model_validate(chat_data)
@@ -0,0 +1,107 @@
+# context.py
+# fmt: off
+"""
+上下文范围与群聊共享缓冲区
+context_scope 决定上下文按用户、按群还是按群内用户划分；
+群模式下另有一个按 token 预算限长的环形缓冲区，记录群里最近的（未@机器人的）消息
+"""
+from __future__ import annotations
+
+from collections import deque
+
+from nonebot.adapters import Event
+
+from .history import ROLE_SYSTEM, Turn
+
+SCOPE_USER = "user"
+SCOPE_GROUP = "group"
+SCOPE_USER_IN_GROUP = "user_in_group"
+CONTEXT_SCOPES = (SCOPE_USER, SCOPE_GROUP, SCOPE_USER_IN_GROUP)
+
+
+def context_key(scope: str, user_id: str, group_id: str | None) -> str:
+    """上下文（历史记录）的归属键，私聊时总是按用户划分"""
+    if group_id is None or scope == SCOPE_USER:
+        return user_id
+    if scope == SCOPE_GROUP:
+        return f"group_{group_id}"
+    return f"{group_id}:{user_id}"
+
+
+def queue_key(scope: str, user_id: str, group_id: str | None) -> str:
+    """任务队列的归属键：同一用户的请求串行，群模式下不同用户的请求可以并发"""
+    if group_id is None or scope == SCOPE_USER:
+        return user_id
+    return f"{group_id}:{user_id}"
+
+
+def get_speaker_name(event: Event, user_id: str) -> str:
+    """发言人显示名（群名片 > 昵称 > 用户ID）"""
+    sender: object = getattr(event, "sender", None)
+    for attr in ("card", "nickname"):
+        name: object = getattr(sender, attr, None)
+        if isinstance(name, str) and name:
+            return name
+    return user_id
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：ASCII 字符约 0.3，其余（中文等）约 0.6"""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return int(ascii_chars * 0.3 + (len(text) - ascii_chars) * 0.6) + 1
+
+
+class GroupBuffer:
+    """群聊最近消息的环形缓冲区，同时受条数与 token 预算约束"""
+
+    __slots__ = ("entries", "tokens", "max_tokens", "max_size", "_turn")
+
+    entries: deque[tuple[str, int]]  # (一行 "发言人: 内容", token 数)
+    tokens: int
+    max_tokens: int
+    max_size: int
+    _turn: Turn | None
+
+    def __init__(self, max_tokens: int, max_size: int) -> None:
+        self.entries = deque()
+        self.tokens = 0
+        self.max_tokens = max_tokens
+        self.max_size = max_size
+        self._turn = None
+
+    def add(self, speaker: str, text: str) -> None:
+        line = f"{speaker}: {text}"
+        cost = estimate_tokens(line)
+        self.entries.append((line, cost))
+        self.tokens += cost
+        while self.entries and (
+            self.tokens > self.max_tokens or len(self.entries) > self.max_size
+        ):
+            _, dropped = self.entries.popleft()
+            self.tokens -= dropped
+        self._turn = None
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.tokens = 0
+        self._turn = None
+
+    def as_turn(self) -> Turn | None:
+        """渲染为一条系统消息，内容不变时复用同一个（已编码的）记录"""
+        if not self.entries:
+            return None
+        if self._turn is None:
+            lines = "\n".join(line for line, _ in self.entries)
+            self._turn = Turn(ROLE_SYSTEM, f"以下是群里最近的聊天记录，供你理解上下文：\n{lines}")
+        return self._turn
+
+
+__all__ = [
+    "CONTEXT_SCOPES",
+    "GroupBuffer",
+    "context_key",
+    "estimate_tokens",
+    "get_speaker_name",
+    "queue_key",
+]
+# fmt: on
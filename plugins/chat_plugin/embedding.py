@@ -0,0 +1,63 @@
+# embedding.py
+# fmt: off
+"""
+本地哈希 n-gram 向量化
+不依赖网络和模型文件：把字符 n-gram 哈希到固定维度并做 L2 归一化，
+向量点积即余弦相似度。需要可选依赖 numpy，未安装时相关功能自动关闭
+"""
+from __future__ import annotations
+
+import zlib
+from functools import cache
+from types import ModuleType
+from typing import Any
+
+from nonebot.log import logger
+
+
+@cache
+def load_numpy() -> ModuleType | None:
+    """按需导入 numpy，未安装时只警告一次"""
+    try:
+        import numpy
+    except ImportError:
+        logger.warning("numpy 未安装，长期记忆与语义缓存将不可用")
+        return None
+    return numpy
+
+
+class HashingEmbedder:
+    """字符 n-gram 哈希向量化（带符号哈希，减小碰撞偏差）"""
+
+    dim: int
+    ngrams: tuple[int, ...]
+    _np: Any
+
+    def __init__(self, np_module: ModuleType, dim: int = 256, ngrams: tuple[int, ...] = (1, 2, 3)) -> None:
+        self._np = np_module
+        self.dim = dim
+        self.ngrams = ngrams
+
+    def embed(self, text: str) -> Any:
+        """返回 (dim,) float32 的 L2 归一化向量"""
+        np = self._np
+        # 忽略空白与标点，"你是谁？" 与 "你是谁" 视为相同
+        text = "".join(c for c in text.lower() if c.isalnum())
+        indices: list[int] = []
+        signs: list[float] = []
+        for n in self.ngrams:
+            for i in range(len(text) - n + 1):
+                h = zlib.crc32(text[i:i + n].encode("utf-8"))
+                indices.append(h % self.dim)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+        vec = np.zeros(self.dim, dtype=np.float32)
+        if indices:
+            vec = np.bincount(indices, weights=signs, minlength=self.dim).astype(np.float32)
+            norm = float(np.linalg.norm(vec))
+            if norm > 0:
+                vec /= norm
+        return vec
+
+
+__all__ = ["HashingEmbedder", "load_numpy"]
+# fmt: on
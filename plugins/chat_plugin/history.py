@@ -0,0 +1,79 @@
+# history.py
+# fmt: off
+"""
+紧凑的上下文表示
+每轮对话是一个 __slots__ 记录，角色字符串驻留共享；每轮的 JSON 片段只编码一次，
+请求体由预编码片段直接拼接，不再每次重新序列化整段历史
+"""
+from __future__ import annotations
+
+import json
+import sys
+from collections.abc import Callable, Iterable
+
+try:
+    import orjson  # type: ignore[import-not-found]  # pyright: ignore[reportMissingImports]
+    _orjson_dumps: Callable[[object], bytes] | None = orjson.dumps
+except ImportError:
+    _orjson_dumps = None
+
+
+def _dumps(obj: object) -> bytes:
+    if _orjson_dumps is not None:
+        return _orjson_dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+ROLE_SYSTEM = sys.intern("system")
+ROLE_USER = sys.intern("user")
+ROLE_ASSISTANT = sys.intern("assistant")
+
+
+def dumps(obj: object) -> bytes:
+    """紧凑 JSON 编码（有 orjson 时使用 orjson）"""
+    return _dumps(obj)
+
+
+class Turn:
+    """一条消息记录"""
+
+    __slots__ = ("role", "content", "_encoded")
+
+    role: str
+    content: str
+    _encoded: bytes | None
+
+    def __init__(self, role: str, content: str) -> None:
+        self.role = sys.intern(role)
+        self.content = content
+        self._encoded = None
+
+    @property
+    def encoded(self) -> bytes:
+        """{"role": ..., "content": ...} 的 JSON 片段，首次访问时编码并缓存"""
+        if self._encoded is None:
+            self._encoded = _dumps({"role": self.role, "content": self.content})
+        return self._encoded
+
+    def to_dict(self) -> dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+    def __repr__(self) -> str:
+        return f"Turn({self.role!r}, {self.content[:20]!r})"
+
+
+def encode_chat_body(options: dict[str, object], fragments: Iterable[bytes]) -> bytes:
+    """把请求参数与预编码的消息片段拼成完整请求体"""
+    head = _dumps(options)[:-1]
+    separator = b',"messages":[' if len(head) > 1 else b'"messages":['
+    return b"".join((head, separator, b",".join(fragments), b"]}"))
+
+
+__all__ = [
+    "ROLE_ASSISTANT",
+    "ROLE_SYSTEM",
+    "ROLE_USER",
+    "Turn",
+    "dumps",
+    "encode_chat_body",
+]
+# fmt: on
@@ -0,0 +1,80 @@
+# limiter.py
+# fmt: off
+"""
+可调整容量的并发限制器
+asyncio.Semaphore 创建后无法修改容量，热重载 max_concurrent 时需要在不打断进行中请求的前提下调整上限：
+扩容立即唤醒等待者；缩容时已占用的名额正常归还，直到占用数降到新上限以下才放行新请求
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from types import TracebackType
+
+
+class Limiter:
+    """FIFO 公平的并发限制器"""
+
+    __slots__ = ("limit", "in_use", "_waiters")
+
+    limit: int
+    in_use: int
+    _waiters: deque[asyncio.Future[None]]
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(limit, 1)
+        self.in_use = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+            return
+        fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 名额已分配但调用方被取消，转交给下一个等待者
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(fut)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self._wake()
+
+    def resize(self, limit: int) -> None:
+        self.limit = max(limit, 1)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_use < self.limit:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_use += 1
+                fut.set_result(None)
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.release()
+
+
+__all__ = ["Limiter"]
+# fmt: on
@@ -0,0 +1,172 @@
+# memory.py
+# fmt: off
+"""
+长期记忆
+滑出 max_history 窗口的对话写入本地向量索引（NumPy 矩阵，内存映射持久化），
+请求时按当前消息检索同一上下文中最相关的 top-k 条旧对话放入提示词
+"""
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from types import ModuleType
+from typing import Any, cast
+
+from nonebot.log import logger
+
+from ..manager_plugin.memstat import sizeof
+from .embedding import HashingEmbedder
+
+
+class LongTermMemory:
+    """按上下文键隔离的向量索引"""
+
+    directory: Path
+    max_items: int
+    embedder: HashingEmbedder
+    owners: list[str]        # 每行所属的上下文键
+    texts: list[str]
+    owner_ids: dict[str, int]
+    count: int
+    _np: Any
+    _vectors: Any            # (capacity, dim) float32；刚加载时为只读内存映射
+    _owner_index: Any        # (capacity,) int32，行 -> owner_ids 编号
+    _mapped: bool
+
+    def __init__(self, np_module: ModuleType, directory: str | Path, dim: int, max_items: int) -> None:
+        self._np = np_module
+        self.directory = Path(directory)
+        self.max_items = max_items
+        self.embedder = HashingEmbedder(np_module, dim)
+        self.owners = []
+        self.texts = []
+        self.owner_ids = {}
+        self.count = 0
+        self._vectors = np_module.zeros((64, dim), dtype=np_module.float32)
+        self._owner_index = np_module.zeros(64, dtype=np_module.int32)
+        self._mapped = False
+
+    def _owner_id(self, owner: str) -> int:
+        oid = self.owner_ids.get(owner)
+        if oid is None:
+            oid = len(self.owner_ids)
+            self.owner_ids[owner] = oid
+        return oid
+
+    def _writable(self, needed: int) -> None:
+        """保证矩阵可写且容量足够（内存映射在第一次写入时复制到内存）"""
+        np = self._np
+        capacity = self._vectors.shape[0]
+        if not self._mapped and needed <= capacity:
+            return
+        new_capacity = max(capacity, 64)
+        while new_capacity < needed:
+            new_capacity *= 2
+        vectors = np.zeros((new_capacity, self.embedder.dim), dtype=np.float32)
+        vectors[:self.count] = self._vectors[:self.count]
+        owner_index = np.zeros(new_capacity, dtype=np.int32)
+        owner_index[:self.count] = self._owner_index[:self.count]
+        self._vectors, self._owner_index = vectors, owner_index
+        self._mapped = False
+
+    def add(self, owner: str, text: str) -> None:
+        if not text.strip():
+            return
+        if self.count >= self.max_items:
+            self._drop_oldest(max(self.max_items // 10, 1))
+        self._writable(self.count + 1)
+        self._vectors[self.count] = self.embedder.embed(text)
+        self._owner_index[self.count] = self._owner_id(owner)
+        self.owners.append(owner)
+        self.texts.append(text)
+        self.count += 1
+
+    def _drop_oldest(self, n: int) -> None:
+        self._writable(self.count)
+        keep = self.count - n
+        self._vectors[:keep] = self._vectors[n:self.count]
+        self._owner_index[:keep] = self._owner_index[n:self.count]
+        del self.owners[:n]
+        del self.texts[:n]
+        self.count = keep
+
+    def search(self, owner: str, query: str, k: int, min_score: float) -> list[str]:
+        """返回该上下文中与 query 最相关的至多 k 条记忆（按相关度降序）"""
+        oid = self.owner_ids.get(owner)
+        if oid is None or self.count == 0 or k <= 0:
+            return []
+        np = self._np
+        rows = np.flatnonzero(self._owner_index[:self.count] == oid)
+        if rows.size == 0:
+            return []
+        scores = self._vectors[rows] @ self.embedder.embed(query)
+        if rows.size > k:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(rows.size)
+        top = top[np.argsort(scores[top])[::-1]]
+        return [self.texts[int(rows[i])] for i in top if float(scores[i]) >= min_score]
+
+    def forget(self, owners: set[str] | None = None) -> None:
+        """删除指定上下文（None 为全部）的记忆"""
+        if owners is None:
+            self.owners, self.texts, self.owner_ids, self.count = [], [], {}, 0
+            return
+        keep = [i for i, owner in enumerate(self.owners) if owner not in owners]
+        if len(keep) == self.count:
+            return
+        np = self._np
+        idx = np.asarray(keep, dtype=np.int64)
+        self._vectors = np.array(self._vectors[idx], dtype=np.float32).reshape(len(keep), self.embedder.dim)
+        self._owner_index = np.array(self._owner_index[idx], dtype=np.int32)
+        self._mapped = False
+        self.owners = [self.owners[i] for i in keep]
+        self.texts = [self.texts[i] for i in keep]
+        self.count = len(keep)
+
+    def memory_usage(self) -> int:
+        """占用字节数估算；内存映射加载的向量按文件大小计（实际驻留取决于访问过的页）"""
+        return sizeof([self.owners, self.texts, self.owner_ids, self._vectors, self._owner_index])
+
+    # ---------- 持久化 ----------
+    def save(self) -> None:
+        np = self._np
+        self.directory.mkdir(parents=True, exist_ok=True)
+        vectors_path = self.directory / "vectors.npy"
+        tmp = self.directory / "vectors.tmp.npy"
+        np.save(tmp, np.ascontiguousarray(self._vectors[:self.count]))
+        os.replace(tmp, vectors_path)
+        meta = {"dim": self.embedder.dim, "owners": self.owners, "texts": self.texts}
+        meta_tmp = self.directory / "meta.json.tmp"
+        _ = meta_tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(meta_tmp, self.directory / "meta.json")
+
+    def load(self) -> int:
+        """以内存映射方式加载向量，返回记忆条数"""
+        vectors_path = self.directory / "vectors.npy"
+        meta_path = self.directory / "meta.json"
+        if not vectors_path.is_file() or not meta_path.is_file():
+            return 0
+        np = self._np
+        try:
+            meta = cast(dict[str, object], json.loads(meta_path.read_text(encoding="utf-8")))
+            vectors = np.load(vectors_path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取长期记忆失败: {e}")
+            return 0
+        owners = [str(o) for o in cast(list[object], meta.get("owners", []))]
+        texts = [str(t) for t in cast(list[object], meta.get("texts", []))]
+        if meta.get("dim") != self.embedder.dim or len(owners) != len(texts) or len(owners) != vectors.shape[0]:
+            logger.warning("长期记忆文件与当前配置不一致，已忽略")
+            return 0
+        self.owners, self.texts, self.owner_ids = owners, texts, {}
+        self._owner_index = np.asarray([self._owner_id(o) for o in owners], dtype=np.int32)
+        self._vectors = vectors
+        self._mapped = True
+        self.count = len(owners)
+        return self.count
+
+
+__all__ = ["LongTermMemory"]
+# fmt: on
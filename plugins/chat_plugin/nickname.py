@@ -0,0 +1,84 @@
+# nickname.py
+# fmt: off
+"""
+昵称/触发词匹配器
+在配置加载时把昵称、别名和正则触发词编译成一个正则，一次扫描同时得到命中位置与跨度
+"""
+from __future__ import annotations
+
+import re
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+from nonebot.log import logger
+
+from .config import ChatConfig
+
+_GLOBAL_FLAGS = re.compile(r"^\(\?([aiLmsux]+)\)")
+
+
+@dataclass(slots=True, frozen=True)
+class NicknameHit:
+    """一次命中：命中的原文与其在消息中的跨度"""
+
+    text: str
+    start: int
+    end: int
+
+
+class NicknameMatcher:
+    """预编译的多模式匹配器"""
+
+    pattern: re.Pattern[str] | None
+    first_chars: frozenset[str] | None  # 纯字面量时的首字符快速拒绝集合
+
+    def __init__(
+        self,
+        nicknames: Iterable[str],
+        aliases: Iterable[str] = (),
+        triggers: Iterable[str] = (),
+    ) -> None:
+        # 字面量按长度倒序，保证 "猫猫酱" 优先于 "猫猫" 命中
+        literals = sorted({n for n in (*nicknames, *aliases) if n}, key=len, reverse=True)
+        alternatives = [re.escape(n) for n in literals]
+
+        valid_triggers: list[str] = []
+        for trigger in triggers:
+            # 开头的全局标志（如 "(?i)atri"）在合并后的正则中不合法，改写成只作用于本触发词的局部标志
+            flags = _GLOBAL_FLAGS.match(trigger)
+            wrapped = (
+                f"(?{flags.group(1)}:{trigger[flags.end():]})" if flags else f"(?:{trigger})"
+            )
+            # 以合并后的形式校验：单独合法的正则放进分支后仍可能出错（全局标志、重名分组等）
+            try:
+                _ = re.compile("|".join([*alternatives, *valid_triggers, wrapped]))
+            except re.error as e:
+                logger.warning(f"无效的触发词正则 {trigger!r}: {e}")
+                continue
+            valid_triggers.append(wrapped)
+        alternatives.extend(valid_triggers)
+
+        self.pattern = re.compile("|".join(alternatives)) if alternatives else None
+        # 含正则触发词时无法预知首字符，只能交给正则本身
+        self.first_chars = (
+            frozenset(n[0] for n in literals) if literals and not valid_triggers else None
+        )
+
+    @classmethod
+    def from_config(cls, config: ChatConfig) -> NicknameMatcher:
+        return cls(config.nickname, config.nickname_aliases, config.trigger_patterns)
+
+    def search(self, text: str) -> NicknameHit | None:
+        """返回最左侧的命中；未提到机器人时尽早返回 None"""
+        if self.pattern is None or not text:
+            return None
+        if self.first_chars is not None and self.first_chars.isdisjoint(text):
+            return None
+        m = self.pattern.search(text)
+        if m is None or m.end() == m.start():
+            return None
+        return NicknameHit(m.group(), m.start(), m.end())
+
+
+__all__ = ["NicknameHit", "NicknameMatcher"]
+# fmt: on
@@ -6,15 +6,63 @@
 # processor.py
 # fmt: off
 import asyncio
+import heapq
+import json
+import os
+import sqlite3
+import sys
 import time
 from dataclasses import dataclass, field
 from asyncio import Future, PriorityQueue
-from typing import cast
+from pathlib import Path
+from typing import TYPE_CHECKING, cast
 
 from nonebot.log import logger
 from nonebot.adapters import Bot, Event
 
+from ..manager_plugin.fastlog import fastlog
+from ..manager_plugin.memstat import sizeof
+from ..manager_plugin.shard import shard_of
 from .config import ChatConfig
+from .context import (
+    SCOPE_GROUP,
+    GroupBuffer,
+    context_key,
+    get_speaker_name,
+    queue_key,
+)
+from .embedding import load_numpy
+from .history import ROLE_ASSISTANT, ROLE_SYSTEM, ROLE_USER, Turn, encode_chat_body
+from .limiter import Limiter
+from .memory import LongTermMemory
+from .routing import ModelRouter, Route
+from .scheduler import SchedulerStats
+from .semantic_cache import SemanticCache
+from .store import SharedStore
+from .usage import UsageStore, parse_usage
+
+if TYPE_CHECKING:
+    import httpx
+
+
+class ProcessorClosedError(RuntimeError):
+    """处理器正在关闭，不再接受新任务"""
+
+
+class QuotaExceededError(RuntimeError):
+    """用户或群的当日 token 配额已用完"""
+
+    scope: str
+
+    def __init__(self, scope: str, used: int, quota: int) -> None:
+        super().__init__(f"{scope} 当日 token 配额已用完 ({used}/{quota})")
+        self.scope = scope
+
+
+def get_group_id(event: Event) -> str | None:
+    """统一获取群号（OneBot V11 为 group_id，QQ 官方为 group_openid），私聊返回 None"""
+    group_id: object = getattr(event, "group_id", None) or getattr(event, "group_openid", None)
+    return str(group_id) if group_id is not None else None
 
 
 @dataclass(order=True)
@@ -24,6 +72,10 @@ class ChatTask:
     priority: int = 0
     message: str = ""
     user_id: str = ""
+    turn: Turn | None = field(default=None, compare=False)
+    context_key: str = field(default="", compare=False)
+    group_id: str | None = field(default=None, compare=False)
+    route: Route | None = field(default=None, compare=False)
     start_time: float = 0.0
     result: Future[str] = field(default_factory=Future)
 
@@ -33,12 +85,26 @@ class ChatTask:
 
     async def execute(self, processor: "ChatProcessor") -> None:
         """执行任务"""
-        async with processor.semaphore:
+        # 语义缓存命中时直接返回，不占用并发名额
+        cached, cache_key = processor.lookup_cache(self)
+        if cached is not None:
+            if not self.result.done():
+                self.result.set_result(cached)
+            return
+        async with processor.limiter:
+            route = self.route or processor.router.default
+            processor.sched.call_started(id(self), self.user_id, route.model)
             try:
-                history = processor.get_history(self.user_id)
+                history = processor.build_context(self)
                 api_response = await processor.call_bigmodel_api(
-                    self.message, history=history
+                    self.turn or self.message,
+                    history=history,
+                    user_id=self.user_id,
+                    group_id=self.group_id,
+                    route=route,
                 )
+                if cache_key is not None:
+                    processor.store_cache(self, cache_key, api_response)
                 if not self.result.done():
                     self.result.set_result(api_response)
                 else:
@@ -47,6 +113,8 @@ class ChatTask:
                 logger.error(f"API call failed: {e}")
                 if not self.result.done():
                     self.result.set_exception(e)
+            finally:
+                processor.sched.call_finished(id(self))
 
 
 class UserTaskQueue:
@@ -57,21 +125,41 @@ class UserTaskQueue:
     queue: PriorityQueue[ChatTask]
     processing: bool
     current_task: ChatTask | None
-    history: list[dict[str, str]]
+    history: list[Turn]
 
-    def __init__(self, user_id: str, processor: "ChatProcessor") -> None:
+    def __init__(
+        self,
+        user_id: str,
+        processor: "ChatProcessor",
+        history: list[Turn] | None = None,
+    ) -> None:
         self.user_id = user_id
         self.processor = processor
         self.queue = PriorityQueue[ChatTask]()
         self.processing = False
         self.current_task = None
-        self.history = []
+        # 群共享模式下多个队列引用同一个历史列表
+        self.history = history if history is not None else []
 
     async def add_task(self, task: ChatTask) -> None:
         """添加任务到队列"""
         await self.queue.put(task)
+        self.processor.sched.task_queued(self.user_id, id(task))
         if not self.processing:
-            _ = asyncio.create_task(self._process_queue())  # type: ignore[unused-awaitable]
+            # 先置位再调度，避免同一用户在协程启动前被重复创建处理协程
+            self.processing = True
+            self.processor.track(asyncio.create_task(self._process_queue()))
+
+    def reject_pending(self, exc: Exception) -> int:
+        """拒绝队列中尚未开始的任务，返回拒绝数量"""
+        rejected = 0
+        while not self.queue.empty():
+            task = self.queue.get_nowait()
+            self.processor.sched.task_left(self.user_id, id(task))
+            if not task.result.done():
+                task.result.set_exception(exc)
+                rejected += 1
+        return rejected
 
     async def _process_queue(self) -> None:
         """处理队列中的任务"""
@@ -79,6 +167,7 @@ class UserTaskQueue:
         try:
             while not self.queue.empty():
                 task = await self.queue.get()
+                self.processor.sched.task_left(self.user_id, id(task))
                 self.current_task = task
                 try:
                     await task.execute(self.processor)
@@ -97,137 +186,469 @@ class ChatProcessor:
 
     config: ChatConfig
     user_queues: dict[str, UserTaskQueue]
-    semaphore: asyncio.Semaphore
+    histories: dict[str, list[Turn]]
+    group_buffers: dict[str, GroupBuffer]
+    limiter: Limiter
     metrics: dict[str, object]
-
-    def __init__(self, config: ChatConfig) -> None:
+    accepting: bool
+    runners: set[asyncio.Task[None]]
+    usage: UsageStore
+    router: ModelRouter
+    memory: LongTermMemory | None
+    semantic_cache: SemanticCache | None
+    worker_id: int
+    worker_count: int
+    shard_all_bots: bool              # 所有账号都参与分片；否则任何上下文都可能经未分片的账号到达本 worker
+    state_dir: Path
+    store: SharedStore | None
+    sched: SchedulerStats
+    dirty_contexts: set[str]          # 待写入共享存储的上下文
+    cluster: dict[int, dict[str, int]]  # 其他 worker 最近一次上报的运行状态
+
+    def __init__(
+        self, config: ChatConfig, worker_id: int = 0, worker_count: int = 1, shard_all_bots: bool = True
+    ) -> None:
         self.config = config
+        self.worker_id = worker_id
+        self.worker_count = max(worker_count, 1)
+        self.shard_all_bots = shard_all_bots
+        # 多 worker 时各进程的本地文件分目录存放，共享数据在 data_dir 下的 cluster.db
+        self.state_dir = Path(config.data_dir)
+        if self.worker_count > 1:
+            self.state_dir = self.state_dir / f"worker{worker_id}"
+        self.store = SharedStore(config.data_dir, worker_id) if config.storage_backend == "sqlite" else None
+        self.sched = SchedulerStats()
+        self.dirty_contexts = set()
+        self.cluster = {}
+        self._clear_cursor = 0
         self.user_queues = {}
+        self.histories = {}
+        self.group_buffers = {}
         self.system_prompt: str = config.system_prompt
-        self.semaphore = asyncio.Semaphore(config.max_concurrent or 5)
+        self.limiter = Limiter(config.max_concurrent or 5)
+        self.accepting = True
+        self.runners = set()
+        self._client: "httpx.AsyncClient | None" = None
+        self.usage = UsageStore(self.state_dir / "usage")
+        self._flusher: "asyncio.Task[None] | None" = None
+        self._system_turn: Turn | None = None
+        self._headers: dict[str, str] = {
+            "Authorization": f"Bearer {config.api_key}",
+            "Content-Type": "application/json",
+        }
         self.metrics = {
             "total_requests": 0,
             "successful_requests": 0,
             "failed_requests": 0,
             "total_response_time": 0.0,
             "current_queue_length": 0,
+            "routes": {},
         }
+        self.router = ModelRouter(config)
+        self.memory = None
+        self.semantic_cache = None
+        if config.semantic_cache:
+            self.semantic_cache = self._build_semantic_cache(config)
+        if config.long_term_memory:
+            self.memory = self._build_memory(config)
+
+    @staticmethod
+    def _build_semantic_cache(config: ChatConfig) -> SemanticCache | None:
+        np_module = load_numpy()
+        if np_module is None:
+            return None
+        return SemanticCache(
+            np_module,
+            config.embedding_dim,
+            config.semantic_cache_size,
+            config.semantic_cache_threshold,
+        )
+
+    def _build_memory(self, config: ChatConfig) -> LongTermMemory | None:
+        np_module = load_numpy()
+        if np_module is None:
+            return None
+        return LongTermMemory(
+            np_module,
+            self.state_dir / "memory",
+            config.embedding_dim,
+            config.memory_max_items,
+        )
 
-    def get_history(self, user_id: str) -> list[dict[str, str]]:
-        if user_id in self.user_queues:
-            return self.user_queues[user_id].history
-        return []
+    def apply_config(self, config: ChatConfig) -> list[str]:
+        """切换到新配置，返回发生变化的配置项
+
+        方法内没有 await，对事件循环中的其他协程而言是原子的：队列、历史记录和进行中的任务原样保留，
+        已经在执行的请求沿用旧的路由结果，之后的请求使用新配置
+        """
+        old = self.config
+        changed = [name for name in ChatConfig.model_fields if getattr(old, name) != getattr(config, name)]
+        if not changed:
+            return changed
+        for name in ("data_dir", "storage_backend", "embedding_dim"):
+            if name in changed:
+                logger.warning(f"{name} 的修改需要重启后生效")
+        self.config = config
+        self.system_prompt = config.system_prompt
+        self._system_turn = None
+        self._headers = {
+            "Authorization": f"Bearer {config.api_key}",
+            "Content-Type": "application/json",
+        }
+        self.router = ModelRouter(config)
+        self.limiter.resize(config.max_concurrent or 5)
+        for buffer in self.group_buffers.values():
+            buffer.max_tokens = config.group_buffer_tokens
+            buffer.max_size = config.group_buffer_size
+
+        # 语义缓存：容量变化时重建；阈值可直接修改（分区键含系统提示词与模型，旧回复不会串用）
+        if not config.semantic_cache:
+            self.semantic_cache = None
+        elif self.semantic_cache is None or "semantic_cache_size" in changed:
+            self.semantic_cache = self._build_semantic_cache(config)
+        else:
+            self.semantic_cache.threshold = config.semantic_cache_threshold
+
+        # 长期记忆：关闭时先落盘，重新开启时从磁盘恢复
+        if not config.long_term_memory:
+            if self.memory is not None:
+                self.memory.save()
+            self.memory = None
+        elif self.memory is None:
+            self.memory = self._build_memory(config)
+            if self.memory is not None:
+                _ = self.memory.load()
+        else:
+            self.memory.max_items = config.memory_max_items
+        return changed
+
+    def get_history(self, key: str) -> list[Turn]:
+        return self.histories.get(key, [])
+
+    def get_queue(self, qkey: str, ckey: str) -> UserTaskQueue:
+        """获取（或创建）任务队列，并绑定到对应上下文的历史列表"""
+        uq = self.user_queues.get(qkey)
+        if uq is None:
+            uq = UserTaskQueue(qkey, self, self.histories.setdefault(ckey, []))
+            self.user_queues[qkey] = uq
+        return uq
+
+    def build_context(self, task: ChatTask) -> list[Turn]:
+        """组装请求上下文：长期记忆 + 群聊缓冲区（群共享模式）+ 历史记录"""
+        history = self.get_history(task.context_key)
+        prefix: list[Turn] = []
+        memory_turn = self.recall(task.context_key, task.message)
+        if memory_turn is not None:
+            prefix.append(memory_turn)
+        if self.config.context_scope == SCOPE_GROUP and task.group_id is not None:
+            buffer = self.group_buffers.get(task.group_id)
+            buffer_turn = buffer.as_turn() if buffer is not None else None
+            if buffer_turn is not None:
+                prefix.append(buffer_turn)
+        return [*prefix, *history] if prefix else history
+
+    def _cacheable(self, task: ChatTask) -> bool:
+        """回答是否可以跨用户复用：上下文不超过 semantic_cache_max_history 轮，
+        且 build_context 不会在前面加上群聊缓冲或长期记忆（这些内容属于特定的群/上下文）"""
+        if len(self.get_history(task.context_key)) // 2 > self.config.semantic_cache_max_history:
+            return False
+        if self.config.context_scope == SCOPE_GROUP and task.group_id is not None:
+            buffer = self.group_buffers.get(task.group_id)
+            if buffer is not None and buffer.entries:
+                return False
+        # 不做检索，只要该上下文有归档的旧对话就视为可能带记忆
+        return self.memory is None or task.context_key not in self.memory.owner_ids
+
+    def lookup_cache(self, task: ChatTask) -> tuple[str | None, object]:
+        """查询语义缓存，返回 (命中的回复, 未命中时供写回用的查询向量)
+
+        依赖上下文的回答不能跨用户复用，见 _cacheable
+        """
+        cache = self.semantic_cache
+        if cache is None or not self._cacheable(task):
+            return None, None
+        route = task.route or self.router.default
+        result, vec = cache.lookup((self.system_prompt, route.model), task.message)
+        if result is not None:
+            fastlog.debug("cache", "Semantic cache hit for user {user_id}", user_id=task.user_id)
+            return result, None
+        return None, vec
+
+    def store_cache(self, task: ChatTask, vec: object, response: str) -> None:
+        # 等待期间群聊缓冲可能有了新消息，写回前再检查一次
+        if self.semantic_cache is None or not response.strip() or not self._cacheable(task):
+            return
+        route = task.route or self.router.default
+        self.semantic_cache.store((self.system_prompt, route.model), vec, response)
+
+    def recall(self, ckey: str, message: str) -> Turn | None:
+        """从长期记忆中检索与当前消息相关的旧对话"""
+        if self.memory is None:
+            return None
+        start = time.perf_counter()
+        hits = self.memory.search(
+            ckey, message, self.config.memory_top_k, self.config.memory_min_score
+        )
+        elapsed = time.perf_counter() - start
+        self.metrics["memory_lookups"] = cast(int, self.metrics.get("memory_lookups", 0)) + 1
+        self.metrics["memory_lookup_time"] = cast(float, self.metrics.get("memory_lookup_time", 0.0)) + elapsed
+        if not hits:
+            return None
+        return Turn(ROLE_SYSTEM, "以下是你们早前聊过的相关内容，供参考：\n" + "\n---\n".join(hits))
+
+    def archive(self, ckey: str, turns: list[Turn]) -> None:
+        """把滑出窗口的对话按一问一答写入长期记忆"""
+        if self.memory is None:
+            return
+        for i in range(0, len(turns) - 1, 2):
+            question, answer = turns[i], turns[i + 1]
+            self.memory.add(ckey, f"{question.content}\n助手: {answer.content}")
+
+    def observe(self, event: Event, user_id: str, text: str) -> None:
+        """群共享模式下记录未@机器人的群消息，供之后的请求理解上下文"""
+        if self.config.context_scope != SCOPE_GROUP or self.config.group_buffer_tokens <= 0:
+            return
+        group_id = get_group_id(event)
+        if group_id is None or not text.strip():
+            return
+        buffer = self.group_buffers.get(group_id)
+        if buffer is None:
+            buffer = GroupBuffer(self.config.group_buffer_tokens, self.config.group_buffer_size)
+            self.group_buffers[group_id] = buffer
+        buffer.add(get_speaker_name(event, user_id), text.strip())
+
+    @staticmethod
+    def _key_matches(ckey: str, key: str) -> bool:
+        """key 可以是上下文键、用户ID（匹配各群内的 群号:用户ID）或群号（匹配 group_群号 与 群号:用户ID）"""
+        return ckey in (key, f"group_{key}") or ckey.endswith(f":{key}") or ckey.startswith(f"{key}:")
+
+    async def clear_history(self, key: str | None = None) -> int:
+        """清除上下文，返回清除的上下文数。key 可以是上下文键、用户ID或群号
+
+        使用共享存储时同时删除其他 worker 持有的上下文，并通知它们清除内存中的副本（数据库操作放到线程中执行）
+        """
+        count = self._clear_local(key)
+        if self.store is not None:
+            count += await asyncio.to_thread(self._clear_shared, self.store, key)
+        return count
+
+    def _clear_local(self, key: str | None) -> int:
+        if key is None:
+            count = sum(1 for history in self.histories.values() if history)
+            for history in self.histories.values():
+                history.clear()
+            for buffer in self.group_buffers.values():
+                buffer.clear()
+            if self.memory is not None:
+                self.memory.forget()
+            self.dirty_contexts.update(self.histories)
+            return count
+        count = 0
+        cleared: set[str] = set()
+        for ckey, history in self.histories.items():
+            if self._key_matches(ckey, key):
+                count += 1 if history else 0
+                history.clear()
+                cleared.add(ckey)
+        group_buffer = self.group_buffers.get(key)
+        if group_buffer is not None:
+            group_buffer.clear()
+        if self.memory is not None and cleared:
+            self.memory.forget(cleared)
+        self.dirty_contexts.update(cleared)
+        return count
+
+    def _clear_shared(self, store: SharedStore, key: str | None) -> int:
+        """删除共享存储中由其他 worker 持有的匹配上下文并广播，返回删除数（阻塞调用，在线程中执行）"""
+        local = set(self.histories)
+        keys = [
+            ckey for ckey in store.history_keys()
+            if ckey not in local and (key is None or self._key_matches(ckey, key))
+        ]
+        deleted = store.delete_histories(keys) if keys else 0
+        store.broadcast_clear(key)
+        return deleted
 
     async def process_message(
         self,
         message: str,
         user_id: str,
         _bot: Bot,
-        event: Event,  # pyright: ignore[reportUnusedParameter]
+        event: Event,
     ) -> str:
         """处理消息"""
-        if user_id not in self.user_queues:
-            self.user_queues[user_id] = UserTaskQueue(user_id, self)
-
+        if not self.accepting:
+            raise ProcessorClosedError("聊天处理器正在关闭")
+        group_id = get_group_id(event)
+        self.check_quota(user_id, group_id)
+        scope = self.config.context_scope
+        ckey = context_key(scope, user_id, group_id)
+        uq = self.get_queue(queue_key(scope, user_id, group_id), ckey)
+
+        route = self.router.route(message, len(uq.history) // 2, group_id, user_id)
+        self.record_route(route)
+
+        # 群共享上下文里需要标明发言人
+        content = message
+        if scope == SCOPE_GROUP and group_id is not None:
+            content = f"{get_speaker_name(event, user_id)}: {message}"
+        user_turn = Turn(ROLE_USER, content)
         task = ChatTask(
             message=message,
             user_id=user_id,
+            turn=user_turn,
+            context_key=ckey,
+            group_id=group_id,
+            route=route,
             start_time=time.time(),
             result=asyncio.Future(),
         )
 
-        await self.user_queues[user_id].add_task(task)
+        await uq.add_task(task)
 
         try:
             result = await task.result
-            self.user_queues[user_id].history.append(
-                {"role": "user", "content": message}
-            )
-            self.user_queues[user_id].history.append(
-                {"role": "assistant", "content": result}
-            )
+            history = uq.history
+            # 请求时已编码的用户消息片段直接进入历史复用
+            history.append(user_turn)
+            history.append(Turn(ROLE_ASSISTANT, result))
             max_history = self.config.max_history * 2
-            if len(self.user_queues[user_id].history) > max_history:
-                self.user_queues[user_id].history = (
-                    self.user_queues[user_id].history[-max_history:]
-                )
+            if len(history) > max_history:
+                self.archive(ckey, history[:-max_history])
+                del history[:-max_history]
+            if self.store is not None:
+                self.dirty_contexts.add(ckey)
             return result
         except Exception as e:
             logger.error(f"Task failed for user {user_id}: {e}")
             raise
 
+    def check_quota(self, user_id: str, group_id: str | None) -> None:
+        """入队前检查当日配额，超出时抛出 QuotaExceededError"""
+        user_quota = self.config.daily_user_token_quota
+        if user_quota > 0:
+            used = self.usage.used_today("user", user_id)
+            if used >= user_quota:
+                raise QuotaExceededError("user", used, user_quota)
+        group_quota = self.config.daily_group_token_quota
+        if group_quota > 0 and group_id is not None:
+            used = self.usage.used_today("group", group_id)
+            if used >= group_quota:
+                raise QuotaExceededError("group", used, group_quota)
+
+    def record_route(self, route: Route) -> None:
+        """在指标中累计各路由的命中次数"""
+        routes = cast(dict[str, int], self.metrics["routes"])
+        routes[route.name] = routes.get(route.name, 0) + 1
+        fastlog.debug(
+            "route", "Routed to {route} (model={model}, max_tokens={max_tokens})",
+            route=route.name, model=route.model, max_tokens=route.max_tokens,
+        )
+
+    def track(self, runner: "asyncio.Task[None]") -> None:
+        """持有队列处理协程的引用，关闭时据此等待或取消"""
+        self.runners.add(runner)
+        runner.add_done_callback(self.runners.discard)
+
+    def get_client(self) -> "httpx.AsyncClient":
+        """复用同一个 HTTP 连接池，关闭时统一释放"""
+        import httpx
+
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.config.timeout)
+        return self._client
+
+    @property
+    def system_turn(self) -> Turn:
+        """系统提示词记录，编码结果随对象缓存，每次请求共享"""
+        if self._system_turn is None or self._system_turn.content != self.system_prompt:
+            self._system_turn = Turn(ROLE_SYSTEM, self.system_prompt)
+        return self._system_turn
+
     async def call_bigmodel_api(
-        self, message: str, history: list[dict[str, str]] | None = None
+        self,
+        message: str | Turn,
+        history: list[Turn] | None = None,
+        *,
+        user_id: str = "",
+        group_id: str | None = None,
+        route: Route | None = None,
     ) -> str:
         """调用 BigModel API（带重试机制）"""
         import httpx
 
-        headers = {
-            "Authorization": f"Bearer {self.config.api_key}",
-            "Content-Type": "application/json",
-        }
+        if route is None:
+            route = self.router.default
 
-        messages: list[dict[str, str]] = [
-            {"role": "system", "content": self.system_prompt}
-        ]
+        user_turn = message if isinstance(message, Turn) else Turn(ROLE_USER, message)
+        fragments: list[bytes] = [self.system_turn.encoded]
         if history:
-            messages.extend(history)
-        messages.append({"role": "user", "content": message})
-
-        payload: dict[str, object] = {
-            "model": self.config.model,
-            "messages": messages,
-            "max_tokens": self.config.max_tokens,
-            "temperature": self.config.temperature,
-            "stream": False,
-        }
+            fragments.extend(turn.encoded for turn in history)
+        fragments.append(user_turn.encoded)
+
+        body = encode_chat_body(
+            {
+                "model": route.model,
+                "max_tokens": route.max_tokens,
+                "temperature": self.config.temperature,
+                "stream": False,
+            },
+            fragments,
+        )
 
-        async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-            try:
-                response = await client.post(
-                    f"{self.config.api_base}/chat/completions",
-                    headers=headers,
-                    json=payload,
-                )
-                _ = response.raise_for_status()
-            except httpx.TimeoutException as e:
-                logger.error(f"API request timeout: {e}")
-                raise
-            except httpx.HTTPStatusError as e:
-                logger.error(
-                    f"HTTP error {e.response.status_code}: {e.response.text[:200]}"
-                )
-                raise
-            except Exception as e:
-                logger.error(f"Unexpected request error: {type(e).__name__}: {e}")
-                raise
+        client = self.get_client()
+        try:
+            response = await client.post(
+                f"{self.config.api_base}/chat/completions",
+                headers=self._headers,
+                content=body,
+                timeout=route.timeout,
+            )
+            _ = response.raise_for_status()
+        except httpx.TimeoutException as e:
+            logger.error(f"API request timeout: {e}")
+            raise
+        except httpx.HTTPStatusError as e:
+            logger.error(
+                f"HTTP error {e.response.status_code}: {e.response.text[:200]}"
+            )
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected request error: {type(e).__name__}: {e}")
+            raise
+
+        raw_data = cast(object, response.json())
+        if not isinstance(raw_data, dict):
+            raise ValueError("API返回格式错误：响应不是字典类型")
+        data = cast(dict[str, object], raw_data)
 
-            raw_data = cast(object, response.json())
-            if not isinstance(raw_data, dict):
-                raise ValueError("API返回格式错误：响应不是字典类型")
-            data = cast(dict[str, object], raw_data)
+        prompt_tokens, completion_tokens = parse_usage(data)
+        self.usage.record(
+            user_id, group_id, route.model, prompt_tokens, completion_tokens
+        )
 
-            choices_raw = data.get("choices")
-            if not isinstance(choices_raw, list) or not choices_raw:
-                raise ValueError("API返回格式错误：choices 字段缺失或为空")
+        choices_raw = data.get("choices")
+        if not isinstance(choices_raw, list) or not choices_raw:
+            raise ValueError("API返回格式错误：choices 字段缺失或为空")
 
-            choices_list = cast(list[object], choices_raw)
-            first_raw: object = choices_list[0]
-            if not isinstance(first_raw, dict):
-                raise ValueError("API返回格式错误：choices[0] 不是字典")
-            first_d = cast(dict[str, object], first_raw)
+        choices_list = cast(list[object], choices_raw)
+        first_raw: object = choices_list[0]
+        if not isinstance(first_raw, dict):
+            raise ValueError("API返回格式错误：choices[0] 不是字典")
+        first_d = cast(dict[str, object], first_raw)
 
-            message_raw = first_d.get("message")
-            if not isinstance(message_raw, dict):
-                raise ValueError("API返回格式错误：message 结构异常")
-            message_d = cast(dict[str, object], message_raw)
+        message_raw = first_d.get("message")
+        if not isinstance(message_raw, dict):
+            raise ValueError("API返回格式错误：message 结构异常")
+        message_d = cast(dict[str, object], message_raw)
 
-            content_raw = message_d.get("content")
-            if not isinstance(content_raw, str):
-                raise ValueError("API返回格式错误：content 不是字符串类型")
+        content_raw = message_d.get("content")
+        if not isinstance(content_raw, str):
+            raise ValueError("API返回格式错误：content 不是字符串类型")
 
-            logger.info(f"API response received: {content_raw[:50]}...")
-            return content_raw
+        fastlog.info("api", "API response received ({chars} chars)", model=route.model, chars=len(content_raw))
+        fastlog.debug("api", "API response: {preview}...", preview=content_raw[:50])
+        return content_raw
 
     async def get_queue_length(self, user_id: str) -> int:
         """获取用户队列长度"""
@@ -237,7 +658,56 @@ class ChatProcessor:
 
     def get_metrics(self) -> dict[str, object]:
         """获取性能指标"""
-        return self.metrics.copy()
+        metrics = self.metrics.copy()
+        metrics["current_queue_length"] = self.sched.queued
+        if self.semantic_cache is not None:
+            metrics["semantic_cache"] = self.semantic_cache.stats()
+        metrics["memory"] = self.memory_usage()
+        return metrics
+
+    # ---------- 内存统计 ----------
+    def context_sizes(self, seen: set[int] | None = None) -> dict[str, int]:
+        """各上下文历史记录占用的字节数估算"""
+        seen = set() if seen is None else seen
+        return {ckey: sizeof(ckey, seen) + sizeof(history, seen) for ckey, history in self.histories.items()}
+
+    def top_contexts(self, limit: int) -> list[tuple[str, int, int]]:
+        """占用最大的上下文：(上下文键, 消息条数, 字节数)"""
+        sizes = self.context_sizes()
+        top = heapq.nlargest(limit, sizes.items(), key=lambda item: item[1])
+        return [(ckey, len(self.histories[ckey]), size) for ckey, size in top]
+
+    @staticmethod
+    def _queue_size(uq: UserTaskQueue, seen: set[int]) -> int:
+        """队列本身与尚未完成的任务；历史列表计入上下文，不在这里重复统计"""
+        size = sys.getsizeof(uq) + sys.getsizeof(uq.__dict__) + sys.getsizeof(uq.queue) + sizeof(uq.user_id, seen)
+        # PriorityQueue 的底层堆（asyncio.Queue 没有公开的遍历接口）
+        heap = cast(list[ChatTask], getattr(uq.queue, "_queue", []))
+        tasks = [*heap, uq.current_task] if uq.current_task is not None else list(heap)
+        size += sys.getsizeof(heap)
+        for task in tasks:
+            size += (
+                sys.getsizeof(task) + sys.getsizeof(task.__dict__) + sys.getsizeof(task.result)
+                + sizeof(task.message, seen) + sizeof(task.user_id, seen)
+                + sizeof(task.context_key, seen) + sizeof(task.turn, seen)
+            )
+        return size
+
+    def memory_usage(self) -> dict[str, int]:
+        """各子系统占用内存的估算（字节），共享的对象只计一次"""
+        seen: set[int] = set()
+        usage = self.usage
+        return {
+            "history": sys.getsizeof(self.histories) + sum(self.context_sizes(seen).values()),
+            "queues": sys.getsizeof(self.user_queues) + sum(
+                self._queue_size(uq, seen) for uq in self.user_queues.values()
+            ),
+            "group_buffers": sizeof(self.group_buffers, seen),
+            "semantic_cache": self.semantic_cache.memory_usage() if self.semantic_cache is not None else 0,
+            "long_term_memory": self.memory.memory_usage() if self.memory is not None else 0,
+            "usage": sizeof([usage.counters, usage.totals, usage.remote_counters, usage.remote_totals], seen),
+            "scheduler": sizeof(self.sched, seen) + sizeof(self.dirty_contexts, seen),
+        }
 
     def cleanup_expired_queues(self) -> None:
         """清理空闲队列"""
@@ -249,3 +719,178 @@ class ChatProcessor:
         for user_id in expired_users:
             del self.user_queues[user_id]
             logger.info(f"Cleaned up expired queue for user {user_id}")
+
+    # ---------- 多 worker ----------
+    def owns(self, ckey: str) -> bool:
+        """上下文是否可能由当前 worker 处理（有账号不参与分片时所有上下文都可能）"""
+        return (
+            self.worker_count <= 1
+            or not self.shard_all_bots
+            or shard_of(ckey, self.worker_count) == self.worker_id
+        )
+
+    def local_stats(self) -> dict[str, int]:
+        return {
+            "contexts": sum(1 for history in self.histories.values() if history),
+            "queued": self.sched.queued,
+            "in_flight": self.limiter.in_use,
+        }
+
+    def cluster_stats(self) -> dict[int, dict[str, int]]:
+        """各 worker 的运行状态（本 worker 为实时数据，其他 worker 为最近一次同步的结果）"""
+        return {**self.cluster, self.worker_id: self.local_stats()}
+
+    async def sync_store(self) -> None:
+        """与共享存储同步：先应用其他 worker 的清除请求，再写入变化的上下文、用量和运行状态，
+        最后读回其他 worker 的用量与状态。快照在事件循环中生成，数据库读写放到线程中执行"""
+        store = self.store
+        if store is None:
+            return
+        for clear_id, target in await asyncio.to_thread(store.fetch_clears, self._clear_cursor):
+            self._clear_cursor = clear_id
+            _ = self._clear_local(target)
+        dirty, self.dirty_contexts = self.dirty_contexts, set()
+        histories = {key: [turn.to_dict() for turn in self.histories.get(key, [])] for key in dirty}
+        day, usage_rows, stats = self.usage.day, self.usage.rows(), self.local_stats()
+        max_age = max(self.config.usage_flush_interval, 1) * 3
+
+        def write() -> tuple[list[object], dict[int, dict[str, int]]]:
+            store.save_histories(histories)
+            store.save_usage(day, usage_rows)
+            store.publish_stats(stats)
+            return cast(list[object], store.load_usage(day, own=False)), store.worker_stats(max_age)
+
+        remote_usage, workers = await asyncio.to_thread(write)
+        if day == self.usage.day:
+            self.usage.set_remote(remote_usage)
+        _ = workers.pop(self.worker_id, None)
+        self.cluster = workers
+
+    # ---------- 持久化与关闭 ----------
+    def _state_path(self, name: str) -> Path:
+        return self.state_dir / name
+
+    def start(self) -> None:
+        """启动后台任务（定期保存用量，使用共享存储时同步集群状态）"""
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_usage_periodically())
+
+    async def _flush_usage_periodically(self) -> None:
+        interval = max(self.config.usage_flush_interval, 1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self.store is not None:
+                    await self.sync_store()
+                else:
+                    self.usage.flush()
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"保存用量失败: {e}")
+
+    def load_state(self) -> int:
+        """从磁盘恢复上下文、当日用量与长期记忆，返回恢复的上下文数"""
+        if self.memory is not None:
+            _ = self.memory.load()
+        if self.store is not None:
+            return self._load_shared_state(self.store)
+        self.usage.load()
+        path = self._state_path("history.json")
+        if not path.is_file():
+            return 0
+        try:
+            raw = cast(object, json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"读取上下文文件失败: {e}")
+            return 0
+        if not isinstance(raw, dict):
+            return 0
+        restored = 0
+        for user_id, turns in cast(dict[str, object], raw).items():
+            if not isinstance(turns, list):
+                continue
+            history = [
+                Turn(str(t.get("role", "")), str(t.get("content", "")))
+                for t in cast(list[dict[str, object]], turns)
+                if isinstance(t, dict)
+            ]
+            if history:
+                self.histories[user_id] = history[-self.config.max_history * 2:]
+                restored += 1
+        return restored
+
+    def _load_shared_state(self, store: SharedStore) -> int:
+        """从共享存储恢复本 worker 当日的用量和可能由本 worker 处理的上下文"""
+        self.usage.load_rows(cast(list[object], store.load_usage(self.usage.day, own=True)))
+        self._clear_cursor = store.last_clear_id()
+        restored = 0
+        for ckey, turns in store.load_histories().items():
+            if not self.owns(ckey):
+                continue
+            history = [Turn(str(t.get("role", "")), str(t.get("content", ""))) for t in turns]
+            if history:
+                self.histories[ckey] = history[-self.config.max_history * 2:]
+                restored += 1
+        return restored
+
+    def _write_json(self, name: str, data: object) -> None:
+        """先写临时文件再替换，避免关闭途中留下半截文件"""
+        path = self._state_path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        _ = tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def save_state(self) -> None:
+        """保存上下文与性能指标（使用共享存储时上下文与用量已在 sync_store 中写入）"""
+        if self.store is None:
+            history = {
+                key: [turn.to_dict() for turn in turns]
+                for key, turns in self.histories.items()
+                if turns
+            }
+            self._write_json("history.json", history)
+            self.usage.flush()
+        self._write_json("metrics.json", self.get_metrics())
+        if self.memory is not None:
+            self.memory.save()
+
+    async def shutdown(self) -> None:
+        """停止接收新任务，等待进行中的请求，拒绝其余任务，保存状态并关闭连接池"""
+        self.accepting = False
+        closed = ProcessorClosedError("聊天处理器正在关闭")
+
+        rejected = sum(uq.reject_pending(closed) for uq in self.user_queues.values())
+        if self.runners:
+            _, pending = await asyncio.wait(
+                set(self.runners), timeout=self.config.shutdown_timeout
+            )
+            for runner in pending:
+                _ = runner.cancel()
+            for uq in self.user_queues.values():
+                task = uq.current_task
+                if task is not None and not task.result.done():
+                    task.result.set_exception(closed)
+                    rejected += 1
+            if pending:
+                _ = await asyncio.wait(pending)
+        logger.info(f"Chat processor drained, {rejected} task(s) rejected")
+
+        if self._flusher is not None:
+            _ = self._flusher.cancel()
+            self._flusher = None
+
+        if self.store is not None:
+            try:
+                await self.sync_store()
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"同步共享存储失败: {e}")
+            self.store.close()
+
+        try:
+            self.save_state()
+        except OSError as e:
+            logger.error(f"保存聊天状态失败: {e}")
+
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
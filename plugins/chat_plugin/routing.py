@@ -0,0 +1,102 @@
+# routing.py
+# fmt: off
+"""
+模型路由
+按消息长度、上下文长度、群号和用户等级为每个请求选择模型、max_tokens 与超时
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, ClassVar, cast
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+if TYPE_CHECKING:
+    from .config import ChatConfig
+
+
+class RouteRule(BaseModel):
+    """一条路由规则，所有已设置的条件同时满足才命中；未设置的输出沿用默认配置"""
+
+    name: str
+    model: str | None = Field(default=None)
+    max_tokens: int | None = Field(default=None)
+    timeout: int | None = Field(default=None)
+    min_length: int = Field(default=0) # 消息最少字符数
+    max_length: int | None = Field(default=None) # 消息最多字符数
+    min_history: int = Field(default=0) # 最少上下文轮数
+    max_history: int | None = Field(default=None) # 最多上下文轮数
+    groups: list[str] = Field(default_factory=list) # 限定群号，空为不限
+    tiers: list[str] = Field(default_factory=list) # 限定用户等级，空为不限
+    model_config: ClassVar[ConfigDict] = ConfigDict(extra="ignore")
+
+    @field_validator("groups", mode="before")
+    @classmethod
+    def parse_groups(cls, v: object) -> list[str]:
+        """群号在配置中通常写成数字，统一转成字符串与事件中的群号比较"""
+        if isinstance(v, (int, str)):
+            return [str(v)]
+        if isinstance(v, (list, set, tuple)):
+            return [str(item).strip() for item in list(cast(list[object], v))]
+        return []
+
+    def matches(
+        self, length: int, turns: int, group_id: str | None, tier: str | None
+    ) -> bool:
+        if length < self.min_length:
+            return False
+        if self.max_length is not None and length > self.max_length:
+            return False
+        if turns < self.min_history:
+            return False
+        if self.max_history is not None and turns > self.max_history:
+            return False
+        if self.groups and group_id not in self.groups:
+            return False
+        if self.tiers and tier not in self.tiers:
+            return False
+        return True
+
+
+@dataclass(slots=True, frozen=True)
+class Route:
+    """路由结果"""
+
+    name: str
+    model: str
+    max_tokens: int
+    timeout: int
+
+
+class ModelRouter:
+    """按规则顺序匹配，第一条命中的规则生效，都不命中时使用默认配置"""
+
+    rules: list[RouteRule]
+    user_tiers: dict[str, str]
+    default: Route
+
+    def __init__(self, config: ChatConfig) -> None:
+        self.rules = list(config.routes)
+        self.user_tiers = dict(config.user_tiers)
+        self.default = Route("default", config.model, config.max_tokens, config.timeout)
+
+    def route(
+        self, message: str, history_turns: int, group_id: str | None, user_id: str
+    ) -> Route:
+        if not self.rules:
+            return self.default
+        tier = self.user_tiers.get(user_id)
+        length = len(message)
+        for rule in self.rules:
+            if rule.matches(length, history_turns, group_id, tier):
+                return Route(
+                    rule.name,
+                    rule.model or self.default.model,
+                    rule.max_tokens or self.default.max_tokens,
+                    rule.timeout or self.default.timeout,
+                )
+        return self.default
+
+
+__all__ = ["ModelRouter", "Route", "RouteRule"]
+# fmt: on
@@ -0,0 +1,73 @@
+# scheduler.py
+# fmt: off
+"""
+调度器状态统计
+入队、出队、开始/结束上游调用时增量维护，查询时只看仍有任务在排队的队列和进行中的请求，
+不遍历全部用户队列
+"""
+from __future__ import annotations
+
+import heapq
+import time
+
+
+class SchedulerStats:
+    """排队与进行中请求的增量统计"""
+
+    __slots__ = ("waiting", "in_flight", "queued", "completed_calls", "call_time")
+
+    waiting: dict[str, dict[int, float]]           # 队列键 -> {任务 id: 入队时间}，只保留非空队列
+    in_flight: dict[int, tuple[str, str, float]]   # 任务 id -> (用户ID, 模型, 开始时间)
+    queued: int
+    completed_calls: int
+    call_time: float
+
+    def __init__(self) -> None:
+        self.waiting = {}
+        self.in_flight = {}
+        self.queued = 0
+        self.completed_calls = 0
+        self.call_time = 0.0
+
+    # ---------- 排队 ----------
+    def task_queued(self, qkey: str, task_id: int) -> None:
+        self.waiting.setdefault(qkey, {})[task_id] = time.monotonic()
+        self.queued += 1
+
+    def task_left(self, qkey: str, task_id: int) -> None:
+        """任务出队（开始执行或被拒绝）"""
+        tasks = self.waiting.get(qkey)
+        if tasks is None or tasks.pop(task_id, None) is None:
+            return
+        self.queued -= 1
+        if not tasks:
+            del self.waiting[qkey]
+
+    def top_queues(self, limit: int) -> list[tuple[str, int, float]]:
+        """排队最多的队列：(队列键, 排队数, 最久等待秒数)"""
+        now = time.monotonic()
+        rows = [
+            (qkey, len(tasks), now - min(tasks.values()))
+            for qkey, tasks in self.waiting.items()
+        ]
+        return heapq.nlargest(limit, rows, key=lambda row: (row[1], row[2]))
+
+    # ---------- 上游调用 ----------
+    def call_started(self, task_id: int, user_id: str, model: str) -> None:
+        self.in_flight[task_id] = (user_id, model, time.monotonic())
+
+    def call_finished(self, task_id: int) -> None:
+        entry = self.in_flight.pop(task_id, None)
+        if entry is not None:
+            self.completed_calls += 1
+            self.call_time += time.monotonic() - entry[2]
+
+    def longest_calls(self, limit: int) -> list[tuple[str, str, float]]:
+        """进行中耗时最长的调用：(用户ID, 模型, 已耗时秒数)"""
+        now = time.monotonic()
+        rows = [(user_id, model, now - start) for user_id, model, start in self.in_flight.values()]
+        return heapq.nlargest(limit, rows, key=lambda row: row[2])
+
+
+__all__ = ["SchedulerStats"]
+# fmt: on
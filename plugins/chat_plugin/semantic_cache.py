@@ -0,0 +1,135 @@
+# semantic_cache.py
+# fmt: off
+"""
+语义近似回复缓存
+按 (系统提示词, 模型) 分区，每个分区是一个固定容量的向量矩阵，
+查询时一次矩阵乘法算出与全部近期提问的余弦相似度，超过阈值即复用回复；满了按 LRU 淘汰。
+向量化前先去掉句末语气词（"你是谁呀" → "你是谁"），字符 n-gram 对短句中多出的一个字很敏感，
+不去掉的话这类改写的相似度只有 0.8 左右，与 "今天/明天天气怎么样" 这类误命中分不开
+"""
+from __future__ import annotations
+
+import time
+from types import ModuleType
+from typing import Any
+
+from ..manager_plugin.memstat import sizeof
+from .embedding import HashingEmbedder
+
+# 句末语气词；"吗" 会改变问句含义，不在其中
+FINAL_PARTICLES = frozenset("呀啊吧呢嘛哦喔噢啦哇")
+
+
+def normalize_query(text: str) -> str:
+    """去掉每个分句末尾的语气词（至少保留一个字）"""
+    clauses: list[str] = []
+    clause: list[str] = []
+    for c in f"{text}。":
+        if c.isalnum():
+            clause.append(c)
+            continue
+        while len(clause) > 1 and clause[-1] in FINAL_PARTICLES:
+            _ = clause.pop()
+        if clause:
+            clauses.append("".join(clause))
+            clause = []
+    return " ".join(clauses)
+
+
+class _Partition:
+    """一个分区：向量矩阵 + 回复 + 最近使用时间"""
+
+    __slots__ = ("vectors", "responses", "last_used", "size")
+
+    vectors: Any      # (capacity, dim) float32
+    responses: list[str]
+    last_used: Any    # (capacity,) int64，逻辑时钟
+    size: int
+
+    def __init__(self, np_module: Any, capacity: int, dim: int) -> None:
+        self.vectors = np_module.zeros((capacity, dim), dtype=np_module.float32)
+        self.responses = []
+        self.last_used = np_module.zeros(capacity, dtype=np_module.int64)
+        self.size = 0
+
+
+class SemanticCache:
+    """有界 LRU 语义缓存"""
+
+    embedder: HashingEmbedder
+    capacity: int
+    threshold: float
+    hits: int
+    misses: int
+    lookup_time: float
+    partitions: dict[tuple[str, str], _Partition]
+    _np: Any
+    _clock: int
+
+    def __init__(self, np_module: ModuleType, dim: int, capacity: int, threshold: float) -> None:
+        self._np = np_module
+        self.embedder = HashingEmbedder(np_module, dim)
+        self.capacity = max(capacity, 1)
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self.lookup_time = 0.0
+        self.partitions = {}
+        self._clock = 0
+
+    def lookup(self, scope: tuple[str, str], text: str) -> tuple[str | None, Any]:
+        """返回 (命中的回复或 None, 查询向量)；向量供未命中时 store 复用"""
+        start = time.perf_counter()
+        vec = self.embedder.embed(normalize_query(text))
+        part = self.partitions.get(scope)
+        result: str | None = None
+        if part is not None and part.size:
+            scores = part.vectors[:part.size] @ vec
+            best = int(scores.argmax())
+            if float(scores[best]) >= self.threshold:
+                self._clock += 1
+                part.last_used[best] = self._clock
+                result = part.responses[best]
+        self.lookup_time += time.perf_counter() - start
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result, vec
+
+    def store(self, scope: tuple[str, str], vec: Any, response: str) -> None:
+        part = self.partitions.get(scope)
+        if part is None:
+            part = _Partition(self._np, self.capacity, self.embedder.dim)
+            self.partitions[scope] = part
+        if part.size < self.capacity:
+            slot = part.size
+            part.responses.append(response)
+            part.size += 1
+        else:
+            slot = int(part.last_used.argmin())
+            part.responses[slot] = response
+        self._clock += 1
+        part.vectors[slot] = vec
+        part.last_used[slot] = self._clock
+
+    def clear(self) -> None:
+        self.partitions.clear()
+
+    def memory_usage(self) -> int:
+        """占用字节数估算；向量矩阵按分区容量预分配，与已用条数无关"""
+        return sizeof(self.partitions)
+
+    def stats(self) -> dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "avg_lookup_ms": self.lookup_time / lookups * 1000 if lookups else 0.0,
+            "entries": sum(p.size for p in self.partitions.values()),
+        }
+
+
+__all__ = ["SemanticCache", "normalize_query"]
+# fmt: on
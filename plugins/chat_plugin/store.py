@@ -0,0 +1,193 @@
+# store.py
+# fmt: off
+"""
+多 worker 共享存储（SQLite）
+storage_backend="sqlite" 时，上下文、当日用量与各 worker 的运行状态写入 data_dir 下的 cluster.db，
+各进程据此得到全集群的上下文数、配额用量，并通过广播表把清除上下文的请求传给持有该上下文的 worker。
+写入在处理器的后台同步任务中批量完成（放到线程里执行），不在消息处理路径上访问数据库
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable, Mapping, Sequence
+from pathlib import Path
+from typing import cast
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    context_key TEXT PRIMARY KEY,
+    worker_id INTEGER NOT NULL,
+    turns TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS usage (
+    day TEXT NOT NULL,
+    worker_id INTEGER NOT NULL,
+    scope TEXT NOT NULL,
+    scope_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt INTEGER NOT NULL,
+    completion INTEGER NOT NULL,
+    requests INTEGER NOT NULL,
+    PRIMARY KEY (day, worker_id, scope, scope_id, model)
+);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id INTEGER PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    heartbeat REAL NOT NULL,
+    stats TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clears (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    worker_id INTEGER NOT NULL,
+    target TEXT,
+    created REAL NOT NULL
+);
+"""
+
+UsageRow = tuple[str, str, str, int, int, int]  # (范围, ID, 模型, prompt, completion, 次数)
+
+
+class SharedStore:
+    """SQLite 共享存储；所有方法都是阻塞调用，由调用方放到线程中执行"""
+
+    path: Path
+    worker_id: int
+    _conn: sqlite3.Connection
+    _lock: threading.Lock
+
+    def __init__(self, directory: str | Path, worker_id: int) -> None:
+        self.path = Path(directory) / "cluster.db"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        with self._lock:
+            _ = self._conn.execute("PRAGMA journal_mode=WAL")
+            _ = self._conn.execute("PRAGMA synchronous=NORMAL")
+            _ = self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---------- 上下文 ----------
+    def load_histories(self) -> dict[str, list[dict[str, object]]]:
+        """读取全部上下文（由调用方按分片筛选属于自己的部分）"""
+        with self._lock:
+            rows = self._conn.execute("SELECT context_key, turns FROM history").fetchall()
+        result: dict[str, list[dict[str, object]]] = {}
+        for key, turns in cast(list[tuple[str, str]], rows):
+            try:
+                result[key] = cast(list[dict[str, object]], json.loads(turns))
+            except json.JSONDecodeError:
+                continue
+        return result
+
+    def save_histories(self, items: Mapping[str, Sequence[Mapping[str, object]]]) -> None:
+        """写入变化过的上下文，空列表表示删除"""
+        now = time.time()
+        upserts = [
+            (key, self.worker_id, json.dumps(turns, ensure_ascii=False), now)
+            for key, turns in items.items() if turns
+        ]
+        deletes = [(key,) for key, turns in items.items() if not turns]
+        with self._lock, self._conn:
+            _ = self._conn.executemany(
+                "INSERT INTO history VALUES (?, ?, ?, ?) ON CONFLICT(context_key) DO UPDATE SET "
+                "worker_id = excluded.worker_id, turns = excluded.turns, updated = excluded.updated",
+                upserts,
+            )
+            _ = self._conn.executemany("DELETE FROM history WHERE context_key = ?", deletes)
+
+    def history_keys(self) -> list[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT context_key FROM history").fetchall()
+        return [key for (key,) in cast(list[tuple[str]], rows)]
+
+    def delete_histories(self, keys: Iterable[str]) -> int:
+        with self._lock, self._conn:
+            cursor = self._conn.executemany(
+                "DELETE FROM history WHERE context_key = ?", [(key,) for key in keys]
+            )
+            return cursor.rowcount
+
+    # ---------- 清除广播 ----------
+    def broadcast_clear(self, target: str | None) -> None:
+        """通知其他 worker 清除上下文（target 为 None 表示全部）"""
+        with self._lock, self._conn:
+            _ = self._conn.execute(
+                "INSERT INTO clears (worker_id, target, created) VALUES (?, ?, ?)",
+                (self.worker_id, target, time.time()),
+            )
+
+    def fetch_clears(self, after_id: int) -> list[tuple[int, str | None]]:
+        """其他 worker 发出的、编号大于 after_id 的清除请求"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, target FROM clears WHERE id > ? AND worker_id != ? ORDER BY id",
+                (after_id, self.worker_id),
+            ).fetchall()
+        return cast(list[tuple[int, str | None]], rows)
+
+    def last_clear_id(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM clears").fetchone()
+        return int(cast(tuple[int], row)[0])
+
+    # ---------- 用量 ----------
+    def save_usage(self, day: str, rows: list[UsageRow]) -> None:
+        """写入本 worker 当日的用量（绝对值，覆盖旧值）"""
+        with self._lock, self._conn:
+            _ = self._conn.executemany(
+                "INSERT OR REPLACE INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(day, self.worker_id, *row) for row in rows],
+            )
+
+    def load_usage(self, day: str, own: bool) -> list[UsageRow]:
+        """读取当日用量：own 为 True 时只读本 worker 的，否则读其他 worker 的合计"""
+        with self._lock:
+            if own:
+                rows = self._conn.execute(
+                    "SELECT scope, scope_id, model, prompt, completion, requests FROM usage "
+                    "WHERE day = ? AND worker_id = ?",
+                    (day, self.worker_id),
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT scope, scope_id, model, SUM(prompt), SUM(completion), SUM(requests) FROM usage "
+                    "WHERE day = ? AND worker_id != ? GROUP BY scope, scope_id, model",
+                    (day, self.worker_id),
+                ).fetchall()
+        return cast(list[UsageRow], rows)
+
+    # ---------- worker 状态 ----------
+    def publish_stats(self, stats: dict[str, int]) -> None:
+        with self._lock, self._conn:
+            _ = self._conn.execute(
+                "INSERT OR REPLACE INTO workers VALUES (?, ?, ?, ?)",
+                (self.worker_id, os.getpid(), time.time(), json.dumps(stats)),
+            )
+
+    def worker_stats(self, max_age: float) -> dict[int, dict[str, int]]:
+        """最近 max_age 秒内有心跳的 worker 的状态"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT worker_id, stats FROM workers WHERE heartbeat >= ?",
+                (time.time() - max_age,),
+            ).fetchall()
+        result: dict[int, dict[str, int]] = {}
+        for worker_id, stats in cast(list[tuple[int, str]], rows):
+            try:
+                result[worker_id] = cast(dict[str, int], json.loads(stats))
+            except json.JSONDecodeError:
+                continue
+        return result
+
+
+__all__ = ["SharedStore"]
+# fmt: on
@@ -0,0 +1,188 @@
+# usage.py
+# fmt: off
+"""
+Token 用量统计
+按天、按用户/群/模型累计 prompt 与 completion token，定期落盘并用于每日配额判断
+"""
+from __future__ import annotations
+
+import datetime
+import heapq
+import json
+import os
+from pathlib import Path
+from typing import cast
+
+from nonebot.log import logger
+
+# 计数器下标
+PROMPT, COMPLETION, REQUESTS = 0, 1, 2
+
+UsageKey = tuple[str, str, str]  # (范围 "user"/"group", ID, 模型)
+
+
+def _today() -> str:
+    return datetime.date.today().isoformat()
+
+
+class UsageStore:
+    """当日 token 用量（内存计数，按天一个 JSON 文件）"""
+
+    directory: Path
+    day: str
+    counters: dict[UsageKey, list[int]]
+    totals: dict[tuple[str, str], int]  # (范围, ID) -> 当日总 token，配额判断 O(1)
+    remote_counters: dict[UsageKey, list[int]]  # 多 worker 模式下其他 worker 的用量
+    remote_totals: dict[tuple[str, str], int]
+    dirty: bool
+
+    def __init__(self, directory: str | Path) -> None:
+        self.directory = Path(directory)
+        self.day = _today()
+        self.counters = {}
+        self.totals = {}
+        self.remote_counters = {}
+        self.remote_totals = {}
+        self.dirty = False
+
+    def _path(self, day: str) -> Path:
+        return self.directory / f"{day}.json"
+
+    def _rollover(self) -> None:
+        """跨天时先保存昨日数据再清零"""
+        today = _today()
+        if today == self.day:
+            return
+        self.flush()
+        self.day = today
+        self.counters.clear()
+        self.totals.clear()
+        self.remote_counters.clear()
+        self.remote_totals.clear()
+
+    def record(
+        self,
+        user_id: str,
+        group_id: str | None,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+    ) -> None:
+        self._rollover()
+        scopes = [("user", user_id)]
+        if group_id is not None:
+            scopes.append(("group", group_id))
+        for scope, scope_id in scopes:
+            counter = self.counters.setdefault((scope, scope_id, model), [0, 0, 0])
+            counter[PROMPT] += prompt_tokens
+            counter[COMPLETION] += completion_tokens
+            counter[REQUESTS] += 1
+            key = (scope, scope_id)
+            self.totals[key] = self.totals.get(key, 0) + prompt_tokens + completion_tokens
+        self.dirty = True
+
+    def used_today(self, scope: str, scope_id: str) -> int:
+        self._rollover()
+        key = (scope, scope_id)
+        return self.totals.get(key, 0) + self.remote_totals.get(key, 0)
+
+    def top(self, scope: str, limit: int = 10) -> list[tuple[str, int]]:
+        """当日用量最多的用户/群（含其他 worker）"""
+        self._rollover()
+        merged: dict[str, int] = {}
+        for totals in (self.totals, self.remote_totals):
+            for (s, sid), total in totals.items():
+                if s == scope:
+                    merged[sid] = merged.get(sid, 0) + total
+        return heapq.nlargest(limit, merged.items(), key=lambda item: item[1])
+
+    def by_model(self) -> dict[str, list[int]]:
+        """按模型汇总（以用户维度计，避免与群维度重复计算）"""
+        result: dict[str, list[int]] = {}
+        for counters in (self.counters, self.remote_counters):
+            for (scope, _, model), counter in counters.items():
+                if scope != "user":
+                    continue
+                acc = result.setdefault(model, [0, 0, 0])
+                for i, value in enumerate(counter):
+                    acc[i] += value
+        return result
+
+    @staticmethod
+    def _add_rows(
+        rows: list[object],
+        counters: dict[UsageKey, list[int]],
+        totals: dict[tuple[str, str], int],
+    ) -> None:
+        for row in rows:
+            if not isinstance(row, (list, tuple)) or len(cast(list[object], row)) != 6:
+                continue
+            scope, scope_id, model, prompt, completion, requests = cast(list[object], row)
+            try:
+                counter = [int(str(prompt)), int(str(completion)), int(str(requests))]
+            except ValueError:
+                continue
+            counters[(str(scope), str(scope_id), str(model))] = counter
+            key = (str(scope), str(scope_id))
+            totals[key] = totals.get(key, 0) + counter[PROMPT] + counter[COMPLETION]
+
+    def rows(self) -> list[tuple[str, str, str, int, int, int]]:
+        return [
+            (scope, scope_id, model, counter[PROMPT], counter[COMPLETION], counter[REQUESTS])
+            for (scope, scope_id, model), counter in self.counters.items()
+        ]
+
+    def load_rows(self, rows: list[object]) -> None:
+        """从共享存储恢复本 worker 当日的用量"""
+        self._add_rows(rows, self.counters, self.totals)
+
+    def set_remote(self, rows: list[object]) -> None:
+        """替换其他 worker 的用量快照（共享存储同步时调用）"""
+        counters: dict[UsageKey, list[int]] = {}
+        totals: dict[tuple[str, str], int] = {}
+        self._add_rows(rows, counters, totals)
+        self.remote_counters, self.remote_totals = counters, totals
+
+    def load(self) -> None:
+        """启动时恢复当日已记录的用量，避免重启后配额被重置"""
+        path = self._path(self.day)
+        if not path.is_file():
+            return
+        try:
+            raw = cast(object, json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"读取用量文件失败: {e}")
+            return
+        if not isinstance(raw, list):
+            return
+        self._add_rows(cast(list[object], raw), self.counters, self.totals)
+
+    def flush(self) -> None:
+        """有新数据时写入磁盘"""
+        if not self.dirty:
+            return
+        rows = [[*key, *counter] for key, counter in self.counters.items()]
+        path = self._path(self.day)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".json.tmp")
+        _ = tmp.write_text(json.dumps(rows, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+        self.dirty = False
+
+
+def parse_usage(data: dict[str, object]) -> tuple[int, int]:
+    """从 API 响应中取出 (prompt_tokens, completion_tokens)，缺失时为 0"""
+    usage = data.get("usage")
+    if not isinstance(usage, dict):
+        return 0, 0
+    u = cast(dict[str, object], usage)
+    prompt = u.get("prompt_tokens")
+    completion = u.get("completion_tokens")
+    return (
+        prompt if isinstance(prompt, int) else 0,
+        completion if isinstance(completion, int) else 0,
+    )
+
+
+__all__ = ["UsageStore", "parse_usage"]
+# fmt: on
@@ -1,4 +1,9 @@
 # fmt: off
+import asyncio
+import inspect
+import time
+_import_started = time.perf_counter()
+
 from nonebot import get_driver, on_command, require
 from nonebot.adapters import Event
 from nonebot.exception import IgnoredException
@@ -6,51 +11,203 @@ from nonebot.log import logger
 from nonebot.message import event_preprocessor
 from nonebot.permission import SUPERUSER
 from nonebot.adapters import Bot as BaseBot
+from nonebot.typing import T_State
+from pathlib import Path
 from types import ModuleType
-from .config import get_config, reload_config
+from .config import ManagerConfig, env_files, get_config, load_global_config, reload_config
+from .dedup import RecentKeys, event_key
+from .dispatcher import dispatcher
+from .fastlog import fastlog
+from .memstat import allocation_tracker, format_bytes, process_rss, sizeof
+from .parsed import ParsedMessage, get_parsed_message
+from .profiler import startup_profiler
+from .shard import owns_event, set_shard_key, shard_of
+from .trace import TraceRecorder
 
 driver = get_driver()
 
+# 管理器指标
+metrics: dict[str, int] = {"duplicate_events": 0, "other_worker_events": 0}
+
+_recent_events: RecentKeys | None = None
+_watcher: "asyncio.Task[None] | None" = None
+_tracer: TraceRecorder | None = None
+
+
+def apply_log_config(cfg: ManagerConfig) -> None:
+    """按配置切换日志模式与采样率"""
+    fastlog.set_sample_rates(cfg.log_sample_rates)
+    fastlog.configure(cfg.log_mode, cfg.log_file, cfg.log_rotation, cfg.log_retention)
+
+
+def apply_trace_config(cfg: ManagerConfig) -> None:
+    """按配置开启、切换或关闭流量录制"""
+    global _tracer
+    if _tracer is not None and cfg.trace_file and _tracer.path == Path(cfg.trace_file):
+        return
+    if _tracer is not None:
+        _tracer.stop()
+        logger.info(f"流量录制已停止，共 {_tracer.recorded} 条: {_tracer.path}")
+        _tracer = None
+    if cfg.trace_file:
+        _tracer = TraceRecorder(cfg.trace_file)
+        _tracer.start()
+        logger.info(f"流量录制已开启: {_tracer.path}")
+
+
+def _get_recent_events(cfg: ManagerConfig) -> RecentKeys | None:
+    """按当前配置获取去重窗口，配置变化时重建"""
+    global _recent_events
+    if cfg.dedup_window <= 0:
+        _recent_events = None
+        return None
+    if (
+        _recent_events is None
+        or _recent_events.window != cfg.dedup_window
+        or _recent_events.capacity != cfg.dedup_capacity
+    ):
+        _recent_events = RecentKeys(cfg.dedup_window, cfg.dedup_capacity)
+    return _recent_events
+
+
+def reload_all() -> str:
+    """重新读取 .env 并重载管理器与聊天插件的配置，返回结果说明"""
+    source = load_global_config()
+    new_config = reload_config(source)
+    apply_log_config(new_config)
+    apply_trace_config(new_config)
+    _start_watcher(new_config)
+    logger.info(f"配置重新加载成功，白名单: {new_config.group_whitelist}")
+    lines = ["配置重新加载成功！"]
+    try:
+        chat_mod: ModuleType = require("chat_plugin")  # type: ignore[assignment]
+        reload_fn = getattr(chat_mod, "reload_config", None)
+        if callable(reload_fn):
+            lines.append(str(reload_fn(source)))  # type: ignore[no-any-return]
+    except Exception as e:
+        # 聊天配置校验失败时保留旧配置继续运行
+        logger.error(f"聊天配置重新加载失败: {e}")
+        lines.append(f"聊天配置重新加载失败，沿用旧配置: {e}")
+    return "\n".join(lines)
+
+
+def _env_mtimes() -> tuple[float | None, ...]:
+    mtimes: list[float | None] = []
+    for path in env_files():
+        try:
+            mtimes.append(path.stat().st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+async def _watch_env_files(interval: float) -> None:
+    """定期检查 .env 文件的修改时间，变化后自动重载配置"""
+    last = _env_mtimes()
+    while True:
+        await asyncio.sleep(interval)
+        current = _env_mtimes()
+        if current == last:
+            continue
+        last = current
+        logger.info("检测到配置文件变化，重新加载配置")
+        try:
+            _ = reload_all()
+        except Exception as e:
+            logger.error(f"配置重新加载失败: {e}")
+
+
+def _start_watcher(cfg: ManagerConfig) -> None:
+    """按配置（重新）启动 .env 监视任务"""
+    global _watcher
+    if _watcher is not None:
+        # 由监视任务自身触发时，它会在下一次 await 处结束
+        _ = _watcher.cancel()
+        _watcher = None
+    if cfg.config_watch_interval > 0:
+        _watcher = asyncio.create_task(_watch_env_files(cfg.config_watch_interval))
+
 
 @driver.on_startup
 async def on_startup() -> None:
+    # 提前加载配置，避免第一条消息承担加载耗时
+    with startup_profiler.measure("manager_plugin", "init"):
+        cfg = get_config()
+        apply_log_config(cfg)
+        apply_trace_config(cfg)
+        _start_watcher(cfg)
     logger.info("管理器插件已启动")
 
 
+@driver.on_shutdown
+async def on_shutdown() -> None:
+    if _watcher is not None:
+        _ = _watcher.cancel()
+    if _tracer is not None:
+        _tracer.stop()
+    # 关闭钩子按注册的逆序执行，这里在其他插件之后运行，它们最后提交的回复也能发出
+    await dispatcher.drain(get_config().send_drain_timeout)
+    # 异步模式下等待队列中的日志写完
+    await fastlog.complete()
+
+
+@driver.on_bot_connect
+async def on_bot_connect() -> None:
+    # 第一个机器人连接上即视为可以回复消息
+    _ = startup_profiler.mark_ready()
+
+
 @event_preprocessor
-async def global_preprocessor(event: Event) -> None:
+async def global_preprocessor(bot: BaseBot, event: Event, state: T_State) -> None:
     """在所有事件处理之前执行，过滤不符合条件的消息"""
-    try:
-        text = event.get_plaintext()
-    except ValueError:
+    cfg = get_config()
+
+    # 多 worker 模式下只处理分到本进程的事件
+    if not owns_event(event, cfg.worker_id, cfg.worker_count, bot.self_id, cfg.shard_bots):
+        metrics["other_worker_events"] += 1
+        raise IgnoredException("由其他 worker 处理")
+
+    # 重复投递的事件在任何匹配器运行之前丢弃
+    recent = _get_recent_events(cfg)
+    if recent is not None:
+        key = event_key(bot, event)
+        if key is not None and recent.seen(key):
+            metrics["duplicate_events"] += 1
+            fastlog.debug("event", "重复事件 {key}，忽略", key=key)
+            raise IgnoredException("重复事件")
+
+    parsed = get_parsed_message(bot, event, state)
+    if parsed is None:
         return
+    if _tracer is not None:
+        _tracer.record(bot, event, parsed)
 
-    stripped = text.strip()
-    cfg = get_config()
+    text = parsed.plaintext
+    stripped = parsed.stripped
 
     # 命令直接放行，不走过滤逻辑
     if stripped in cfg.commands:
-        logger.debug(f"检测到命令 {stripped}，放行")
+        fastlog.debug("event", "检测到命令 {command}，放行", command=stripped)
         return
 
     if not cfg.global_switch:
-        logger.debug("全局开关关闭，忽略所有消息")
+        fastlog.debug("event", "全局开关关闭，忽略所有消息")
         raise IgnoredException("全局关闭")
 
     for keyword in cfg.ban_keywords:
         if keyword in text:
-            logger.debug(f"消息包含违禁词 '{keyword}'，忽略")
+            fastlog.debug("event", "消息包含违禁词 '{keyword}'，忽略", keyword=keyword)
             raise IgnoredException("违禁词过滤")
 
     user_id = event.get_user_id()
     if user_id.isdigit() and int(user_id) in cfg.user_blacklist:
-        logger.debug(f"用户 {user_id} 在黑名单中，忽略")
+        fastlog.debug("event", "用户 {user_id} 在黑名单中，忽略", user_id=user_id)
         raise IgnoredException("用户黑名单")
 
     group_id: object = getattr(event, "group_id", None)
     if group_id is not None and isinstance(group_id, int):
         if cfg.group_whitelist and group_id not in cfg.group_whitelist:
-            logger.debug(f"群 {group_id} 不在白名单中，忽略")
+            fastlog.debug("event", "群 {group_id} 不在白名单中，忽略", group_id=group_id)
             raise IgnoredException("群不在白名单")
 
 clear_cmd = on_command("/clear", permission=SUPERUSER, priority=10, block=True)
@@ -69,6 +226,8 @@ async def handle_clear(bot: BaseBot, event: Event) -> None:
             plain = event.get_plaintext().strip()
             arg = plain.removeprefix("/clear").strip()
             count: object = clear_fn(arg) if arg else clear_fn()  # type: ignore[no-any-return]
+            if inspect.isawaitable(count):
+                count = await count
             await bot.send(event, f"已清除 {count} 位用户的上下文")  # pyright: ignore[reportUnknownMemberType]
         else:
             await bot.send(event, "chat_plugin 不支持清除上下文")  # pyright: ignore[reportUnknownMemberType]
@@ -76,6 +235,96 @@ async def handle_clear(bot: BaseBot, event: Event) -> None:
         await bot.send(event, f"清除失败: {e}")  # pyright: ignore[reportUnknownMemberType]
 
 
+usage_cmd = on_command("/usage", permission=SUPERUSER, priority=10, block=True)
+
+
+@usage_cmd.handle()
+async def handle_usage(bot: BaseBot, event: Event) -> None:
+    try:
+        chat_mod: ModuleType = require("chat_plugin")  # type: ignore[assignment]
+        report_fn = getattr(chat_mod, "get_usage_report", None)
+        if callable(report_fn):
+            arg = event.get_plaintext().strip().removeprefix("/usage").strip()
+            report: object = report_fn(int(arg)) if arg.isdigit() else report_fn()  # type: ignore[no-any-return]
+            await bot.send(event, str(report))  # pyright: ignore[reportUnknownMemberType]
+        else:
+            await bot.send(event, "chat_plugin 不支持用量统计")  # pyright: ignore[reportUnknownMemberType]
+    except Exception as e:
+        await bot.send(event, f"查询用量失败: {e}")  # pyright: ignore[reportUnknownMemberType]
+
+
+sched_cmd = on_command("/sched", permission=SUPERUSER, priority=10, block=True)
+
+
+@sched_cmd.handle()
+async def handle_sched(bot: BaseBot, event: Event) -> None:
+    try:
+        chat_mod: ModuleType = require("chat_plugin")  # type: ignore[assignment]
+        report_fn = getattr(chat_mod, "get_scheduler_report", None)
+        if callable(report_fn):
+            arg = event.get_plaintext().strip().removeprefix("/sched").strip()
+            report: object = report_fn(int(arg)) if arg.isdigit() else report_fn()  # type: ignore[no-any-return]
+            await bot.send(event, str(report))  # pyright: ignore[reportUnknownMemberType]
+        else:
+            await bot.send(event, "chat_plugin 不支持调度器状态查询")  # pyright: ignore[reportUnknownMemberType]
+    except Exception as e:
+        await bot.send(event, f"查询调度器状态失败: {e}")  # pyright: ignore[reportUnknownMemberType]
+
+
+MEMORY_LABELS: dict[str, str] = {
+    "send_buckets": "限速令牌桶",
+    "send_queues": "待发送消息",
+    "dedup": "去重窗口",
+    "trace": "流量录制缓冲",
+}
+
+
+def memory_usage() -> dict[str, int]:
+    """管理器各部分内存占用的估算（字节）"""
+    return {
+        "send_buckets": sizeof([dispatcher.target_buckets, dispatcher.bot_buckets]),
+        "send_queues": sizeof(dispatcher.lanes),
+        "dedup": sizeof(_recent_events) if _recent_events is not None else 0,
+        "trace": sizeof(_tracer.pending) if _tracer is not None else 0,
+    }
+
+
+mem_cmd = on_command("/mem", permission=SUPERUSER, priority=10, block=True)
+
+
+@mem_cmd.handle()
+async def handle_mem(bot: BaseBot, event: Event) -> None:
+    arg = event.get_plaintext().strip().removeprefix("/mem").strip()
+    try:
+        if arg == "stop":
+            allocation_tracker.stop()
+            await bot.send(event, "已停止追踪内存分配")  # pyright: ignore[reportUnknownMemberType]
+            return
+        lines: list[str] = []
+        rss = process_rss()
+        if rss is not None:
+            lines.append(f"进程常驻内存: {format_bytes(rss)}")
+        chat_mod: ModuleType = require("chat_plugin")  # type: ignore[assignment]
+        report_fn = getattr(chat_mod, "get_memory_report", None)
+        if callable(report_fn):
+            report: object = report_fn(int(arg)) if arg.isdigit() else report_fn()  # type: ignore[no-any-return]
+            lines.append(str(report))
+        usage = memory_usage()
+        lines.append(f"管理器内存（估算）: {format_bytes(sum(usage.values()))}")
+        lines.extend(f"   • {MEMORY_LABELS[name]}: {format_bytes(size)}" for name, size in usage.items())
+        if arg == "diff":
+            lines.extend(allocation_tracker.diff(10))
+        await bot.send(event, "\n".join(lines))  # pyright: ignore[reportUnknownMemberType]
+    except Exception as e:
+        await bot.send(event, f"查询内存占用失败: {e}")  # pyright: ignore[reportUnknownMemberType]
+
+
+def get_metrics() -> dict[str, int]:
+    """管理器指标（重复事件数、出站消息统计、内存占用估算等）"""
+    memory = {f"memory_{name}": size for name, size in memory_usage().items()}
+    return {**metrics, **dispatcher.stats, "pending_sends": dispatcher.pending, **memory}
+
+
 def check_permission(event: Event) -> bool:
     """供其他插件调用的权限查询接口"""
     cfg = get_config()
@@ -105,14 +354,25 @@ reload_cmd = on_command("/reload", permission=SUPERUSER, priority=4, block=True)
 async def reload_handle() -> None:
     # finish() 放在 try 块外，避免 FinishedException 被误捕获
     try:
-        new_config = reload_config()
-        logger.info(f"配置重新加载成功，白名单: {new_config.group_whitelist}")
-        msg = "配置重新加载成功！"
+        msg = reload_all()
     except Exception as e:
         logger.error(f"配置重新加载失败: {e}")
         msg = f"配置重新加载失败: {e}"
     await reload_cmd.finish(msg)  # pyright: ignore[reportUnknownMemberType]
 
 
-__all__ = ["check_permission"]
+startup_profiler.record("manager_plugin", "import", time.perf_counter() - _import_started)
+
+__all__ = [
+    "ParsedMessage",
+    "check_permission",
+    "dispatcher",
+    "fastlog",
+    "get_metrics",
+    "get_parsed_message",
+    "memory_usage",
+    "set_shard_key",
+    "shard_of",
+    "startup_profiler",
+]
 # fmt: on
@@ -1,8 +1,10 @@
 # fmt: off
 import json
-from typing import cast, ClassVar
+from pathlib import Path
+from typing import Any, cast, ClassVar
 from pydantic import BaseModel, Field, field_validator, ConfigDict
 from nonebot import get_driver
+from nonebot.config import Config
 from nonebot.log import logger
 
 
@@ -14,6 +16,54 @@ class ManagerConfig(BaseModel):
     group_whitelist: list[int] = Field(default_factory=list)
     user_blacklist: list[int] = Field(default_factory=list)
     commands: list[str] = Field(default_factory=list)
+    dedup_window: float = Field(default=60.0)  # 重复事件判定窗口（秒），0 为关闭去重
+    dedup_capacity: int = Field(default=4096)  # 窗口内最多记录的事件数
+    log_mode: str = Field(default="sync")  # 日志模式：sync 同步写出，async 队列 + 后台线程写出
+    log_file: str = Field(default="")  # JSON 行日志文件路径，留空不输出
+    log_rotation: str = Field(default="20 MB")  # JSON 日志轮转条件（大小或时间，loguru 格式）
+    log_retention: int = Field(default=5)  # 保留的轮转文件数
+    log_sample_rates: dict[str, float] = Field(default_factory=dict)  # 按类别的日志采样率，如 {"chat": 0.1}
+    config_watch_interval: float = Field(default=0)  # 检查 .env 文件变化的间隔（秒），0 为关闭自动重载
+    worker_id: int = Field(default=0)  # 多 worker 模式下本进程的编号（0 ~ worker_count-1）
+    worker_count: int = Field(default=1)  # worker 进程总数，1 为单进程模式
+    shard_bots: list[str] | None = Field(default=None)  # 参与分片的账号（须同时连接所有 worker），不设置时所有账号都参与分片
+    send_target_rate: float = Field(default=1.0)  # 每个群/私聊每秒最多发送的消息数，0 为不限
+    send_target_burst: int = Field(default=3)  # 每个群/私聊允许的突发条数
+    send_bot_rate: float = Field(default=5.0)  # 每个机器人账号每秒最多发送的消息数，0 为不限
+    send_bot_burst: int = Field(default=10)  # 每个机器人账号允许的突发条数
+    send_max_length: int = Field(default=1500)  # 单条消息最大字符数，超出时按句子拆分，0 为不拆分
+    send_retries: int = Field(default=2)  # 发送失败的重试次数
+    send_retry_backoff: float = Field(default=1.0)  # 首次重试前等待的秒数，之后每次翻倍
+    send_drain_timeout: float = Field(default=10.0)  # 关闭时等待未发完消息的最长秒数
+    trace_file: str = Field(default="")  # 入站流量轨迹文件路径（供 tools/replay.py 回放），留空不录制
+
+    @field_validator("log_mode", mode="before")
+    @classmethod
+    def validate_log_mode(cls, v: object) -> str:
+        mode = str(v).strip().lower()
+        if mode not in ("sync", "async"):
+            logger.warning(f"无效的 log_mode: {v}，将使用 sync")
+            return "sync"
+        return mode
+
+    @field_validator("log_sample_rates", mode="before")
+    @classmethod
+    def parse_sample_rates(cls, v: object) -> dict[str, float]:
+        if isinstance(v, str):
+            try:
+                v = cast(object, json.loads(v))
+            except json.JSONDecodeError:
+                logger.warning(f"解析 log_sample_rates 失败: {v}，将不做采样")
+                return {}
+        if not isinstance(v, dict):
+            return {}
+        result: dict[str, float] = {}
+        for key, rate in cast(dict[object, object], v).items():
+            try:
+                result[str(key)] = min(max(float(str(rate)), 0.0), 1.0)
+            except ValueError:
+                logger.warning(f"无效的采样率: {key}={rate}")
+        return result
 
     @field_validator("ban_keywords", mode="before")
     @classmethod
@@ -44,6 +94,26 @@ class ManagerConfig(BaseModel):
             return [str(cmd).strip() for cmd in list(cast(list[object], v)) if cmd]
         return []
 
+    @field_validator("shard_bots", mode="before")
+    @classmethod
+    def parse_shard_bots(cls, v: object) -> list[str] | None:
+        """未设置（None 或空字符串）时返回 None；"[]" 表示没有账号参与分片"""
+        if v is None or (isinstance(v, str) and not v.strip()):
+            return None
+        if isinstance(v, (int, str)):
+            text = str(v).strip()
+            if text.startswith("[") and text.endswith("]"):
+                try:
+                    v = cast(object, json.loads(text))
+                except json.JSONDecodeError:
+                    logger.warning(f"解析 shard_bots 失败: {text}，所有账号都将参与分片")
+                    return None
+            else:
+                return [p.strip() for p in text.split(",") if p.strip()]
+        if isinstance(v, (list, set)):
+            return [str(item).strip() for item in list(cast(list[object], v))]
+        return None
+
     @field_validator("group_whitelist", "user_blacklist", mode="before")
     @classmethod
     def parse_int_list(cls, v: object) -> list[int]:
@@ -72,9 +142,8 @@ class ManagerConfig(BaseModel):
         return result
 
     @classmethod
-    def from_env(cls) -> "ManagerConfig":
-        global_config = get_driver().config
-        dumped = global_config.model_dump()
+    def from_env(cls, source: dict[str, object] | None = None) -> "ManagerConfig":
+        dumped = source if source is not None else get_driver().config.model_dump()
         manager_data = cast(dict[str, object], dumped.get("manager", {}))
         logger.info(f"[DEBUG] manager_data: {manager_data}")
         result = cls.model_validate(manager_data)
@@ -82,6 +151,43 @@ class ManagerConfig(BaseModel):
         return result
 
 
+def env_files() -> tuple[Path, ...]:
+    """NoneBot 读取的配置文件：.env 与 .env.{环境名}"""
+    return (Path(".env"), Path(f".env.{get_driver().env}"))
+
+
+def _diff_config(current: dict[str, object], baseline: dict[str, object]) -> dict[str, object]:
+    """current 中与 baseline 不同的项（嵌套字典逐项比较）"""
+    result: dict[str, object] = {}
+    for key, value in current.items():
+        base = baseline.get(key)
+        if isinstance(value, dict) and isinstance(base, dict):
+            nested = _diff_config(cast(dict[str, object], value), cast(dict[str, object], base))
+            if nested:
+                result[key] = nested
+        elif key not in baseline or value != base:
+            result[key] = value
+    return result
+
+
+def _read_env_config() -> dict[str, object]:
+    return Config(_env_file=tuple(str(p) for p in env_files())).model_dump(exclude_unset=True)  # pyright: ignore[reportCallIssue]
+
+
+# nonebot.init() 传入的配置项：启动时的全局配置中与 .env 不一致的部分（init 参数优先于 .env）
+_init_overrides: dict[str, Any] = _diff_config(get_driver().config.model_dump(exclude_unset=True), _read_env_config())
+
+
+def load_global_config() -> dict[str, object]:
+    """重新读取 .env 文件得到全局配置
+
+    driver.config 只在启动时构建一次，这里按 nonebot.init() 的方式重新构建：
+    .env 中的值加上 init() 传入的配置项（按嵌套字典逐项合并，init 参数优先），
+    从 .env 中删除的配置项恢复为默认值
+    """
+    return Config(**_init_overrides, _env_file=tuple(str(p) for p in env_files())).model_dump()  # pyright: ignore[reportCallIssue]
+
+
 # 内部配置实例
 _config: ManagerConfig | None = None
 
@@ -94,9 +200,9 @@ def get_config() -> ManagerConfig:
     return _config  # 此时 _config 已经不是 None，但 mypy 不知道
 
 
-def reload_config() -> ManagerConfig:
+def reload_config(source: dict[str, object] | None = None) -> ManagerConfig:
     global _config
-    new_config = ManagerConfig.from_env()
+    new_config = ManagerConfig.from_env(source if source is not None else load_global_config())
     _config = new_config
     logger.info(f"管理器配置已重新加载: 全局开关={new_config.global_switch}, 白名单群={new_config.group_whitelist}, 黑名单用户={new_config.user_blacklist}, 命令={new_config.commands}")
     return new_config
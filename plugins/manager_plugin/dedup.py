@@ -0,0 +1,59 @@
+# dedup.py
+# fmt: off
+"""
+入站事件去重
+适配器重连或多连接重复投递同一条消息时，按 (适配器, self_id, message_id) 在时间窗口内丢弃重复事件
+"""
+from __future__ import annotations
+
+import time
+from collections import deque
+from collections.abc import Hashable
+
+from nonebot.adapters import Bot as BaseBot, Event
+
+
+class RecentKeys:
+    """有界时间窗口集合：环形队列记录到达顺序，哈希集合做 O(1) 查重"""
+
+    __slots__ = ("window", "capacity", "order", "keys")
+
+    window: float
+    capacity: int
+    order: deque[tuple[float, Hashable]]
+    keys: set[Hashable]
+
+    def __init__(self, window: float, capacity: int) -> None:
+        self.window = window
+        self.capacity = capacity
+        self.order = deque()
+        self.keys = set()
+
+    def seen(self, key: Hashable, now: float | None = None) -> bool:
+        """key 在窗口内出现过返回 True，否则记录并返回 False"""
+        now = time.monotonic() if now is None else now
+        order, keys = self.order, self.keys
+        expire = now - self.window
+        while order and (order[0][0] < expire or len(order) >= self.capacity):
+            _, old = order.popleft()
+            keys.discard(old)
+        if key in keys:
+            return True
+        keys.add(key)
+        order.append((now, key))
+        return False
+
+
+def event_key(bot: BaseBot, event: Event) -> tuple[str, str, str, str] | None:
+    """事件去重键；带上事件类型，避免撤回通知等携带相同 message_id 的事件被误判。没有消息 ID 的事件不参与去重"""
+    message_id: object = getattr(event, "message_id", None)
+    if message_id is None:
+        # QQ 官方适配器的消息 ID 字段为 id
+        message_id = getattr(event, "id", None)
+    if message_id is None:
+        return None
+    return (bot.adapter.get_name(), bot.self_id, event.get_type(), str(message_id))
+
+
+__all__ = ["RecentKeys", "event_key"]
+# fmt: on
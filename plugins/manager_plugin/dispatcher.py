@@ -0,0 +1,264 @@
+# dispatcher.py
+# fmt: off
+"""
+出站消息调度
+所有插件的回复经由这里发出：
+- 每个会话（群/私聊）与每个机器人各有一个令牌桶，突发回复按速率排队，避免被 QQ 限流或风控
+- 过长的回复在句子边界处拆成多条
+- 发送失败按指数退避重试
+- 会话结束且令牌已回满的令牌桶会被回收，关闭时未发出的回复以空结果结束
+submit() 只是把消息放进会话的队列，立即返回，处理协程不必等待发送完成；同一会话内按提交顺序发送
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+
+from nonebot.adapters import Bot as BaseBot, Event, Message, MessageSegment
+from nonebot.log import logger
+
+from .config import ManagerConfig, get_config
+
+OutgoingMessage = str | Message | MessageSegment
+
+# 优先在这些字符之后断开
+SENTENCE_ENDS = frozenset("。！？!?；;…~\n")
+
+
+def split_message(text: str, limit: int) -> list[str]:
+    """按句子边界把文本拆成不超过 limit 个字符的若干段；找不到边界时硬切"""
+    if limit <= 0 or len(text) <= limit:
+        return [text]
+    parts: list[str] = []
+    start = 0
+    while len(text) - start > limit:
+        end = start + limit
+        cut = -1
+        # 只在后半段找边界，避免切出过短的片段
+        for i in range(end - 1, start + limit // 2 - 1, -1):
+            if text[i] in SENTENCE_ENDS:
+                cut = i + 1
+                break
+        if cut == -1:
+            cut = end
+        part = text[start:cut].strip()
+        if part:
+            parts.append(part)
+        start = cut
+    tail = text[start:].strip()
+    if tail:
+        parts.append(tail)
+    return parts
+
+
+class TokenBucket:
+    """预约式令牌桶：reserve() 扣除一个令牌并返回需要等待的秒数，令牌可透支以表示排队"""
+
+    __slots__ = ("tokens", "updated")
+
+    tokens: float
+    updated: float
+
+    def __init__(self, capacity: float) -> None:
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, rate: float, capacity: float, now: float) -> float:
+        if rate <= 0:
+            return 0.0
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / rate
+
+    def full(self, rate: float, capacity: float, now: float) -> bool:
+        """令牌是否已回满；回满的桶与新建的桶等价，可以丢弃"""
+        return rate <= 0 or self.tokens + (now - self.updated) * rate >= capacity
+
+
+@dataclass(slots=True)
+class _Job:
+    bot: BaseBot
+    event: Event
+    parts: list[OutgoingMessage]
+    result: asyncio.Future[list[object]]
+    after: Callable[[], Awaitable[object]] | None = None
+
+
+@dataclass(slots=True)
+class _Lane:
+    """一个会话的发送队列"""
+    jobs: deque[_Job] = field(default_factory=deque)
+    runner: asyncio.Task[None] | None = None
+
+
+def target_key(bot: BaseBot, event: Event) -> str:
+    """会话键：群聊按群，私聊按用户"""
+    for attr in ("group_id", "group_openid"):
+        group_id: object = getattr(event, attr, None)
+        if group_id is not None:
+            return f"{bot.self_id}:group_{group_id}"
+    try:
+        return f"{bot.self_id}:{event.get_user_id()}"
+    except (ValueError, NotImplementedError):
+        return f"{bot.self_id}:"
+
+
+class OutboundDispatcher:
+    """按会话排队、按令牌桶限速的出站消息调度器"""
+
+    lanes: dict[str, _Lane]
+    target_buckets: dict[str, TokenBucket]
+    bot_buckets: dict[str, TokenBucket]
+    stats: dict[str, int]
+
+    def __init__(self) -> None:
+        self.lanes = {}
+        self.target_buckets = {}
+        self.bot_buckets = {}
+        self.stats = {"sent_messages": 0, "send_retries": 0, "send_failures": 0, "split_replies": 0}
+
+    def submit(
+        self,
+        bot: BaseBot,
+        event: Event,
+        message: OutgoingMessage,
+        after: Callable[[], Awaitable[object]] | None = None,
+    ) -> asyncio.Future[list[object]]:
+        """提交一条回复，返回各段发送结果的 Future；after 在本条回复全部发出（或放弃）后执行"""
+        cfg = get_config()
+        if isinstance(message, str):
+            parts: list[OutgoingMessage] = list(split_message(message, cfg.send_max_length))
+            if len(parts) > 1:
+                self.stats["split_replies"] += 1
+        else:
+            parts = [message]
+        job = _Job(bot, event, parts, asyncio.get_running_loop().create_future(), after)
+        key = target_key(bot, event)
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = _Lane()
+            self.lanes[key] = lane
+        lane.jobs.append(job)
+        if lane.runner is None:
+            lane.runner = asyncio.create_task(self._run_lane(key, lane))
+        return job.result
+
+    async def send(self, bot: BaseBot, event: Event, message: OutgoingMessage) -> list[object]:
+        """提交并等待发送完成（需要发送结果时使用，例如之后要撤回的消息）"""
+        return await self.submit(bot, event, message)
+
+    async def _run_lane(self, key: str, lane: _Lane) -> None:
+        job: _Job | None = None
+        results: list[object] = []
+        try:
+            while lane.jobs:
+                job = lane.jobs.popleft()
+                results = []
+                try:
+                    for part in job.parts:
+                        results.append(await self._send_part(key, job, part))
+                except Exception as e:
+                    self.stats["send_failures"] += 1
+                    logger.error(f"消息发送失败（已重试）: {e}")
+                if not job.result.done():
+                    job.result.set_result(results)
+                if job.after is not None:
+                    try:
+                        _ = await job.after()
+                    except Exception as e:
+                        logger.debug(f"发送后续操作失败: {e}")
+        except asyncio.CancelledError:
+            # 关闭时被取消：正在发送的回复返回已发出的部分，排队中的回复以空结果结束，等待方不会一直挂起
+            if job is not None and not job.result.done():
+                job.result.set_result(results)
+            self._abandon(lane)
+            raise
+        finally:
+            lane.runner = None
+            if not lane.jobs:
+                _ = self.lanes.pop(key, None)
+                self._evict_buckets()
+
+    @staticmethod
+    def _abandon(lane: _Lane) -> None:
+        while lane.jobs:
+            job = lane.jobs.popleft()
+            if not job.result.done():
+                job.result.set_result([])
+
+    def _evict_buckets(self) -> None:
+        """回收没有活跃会话且令牌已回满的令牌桶，避免每个出现过的会话都留下一个桶"""
+        cfg = get_config()
+        now = time.monotonic()
+        for key in [
+            key for key, bucket in self.target_buckets.items()
+            if key not in self.lanes and bucket.full(cfg.send_target_rate, cfg.send_target_burst, now)
+        ]:
+            del self.target_buckets[key]
+        active_bots = {key.partition(":")[0] for key in self.lanes}
+        for bot_id in [
+            bot_id for bot_id, bucket in self.bot_buckets.items()
+            if bot_id not in active_bots and bucket.full(cfg.send_bot_rate, cfg.send_bot_burst, now)
+        ]:
+            del self.bot_buckets[bot_id]
+
+    async def _send_part(self, key: str, job: _Job, part: OutgoingMessage) -> object:
+        cfg = get_config()
+        attempt = 0
+        while True:
+            await self._throttle(cfg, key, job.bot.self_id)
+            try:
+                result: object = await job.bot.send(job.event, part)  # pyright: ignore[reportUnknownMemberType]
+                self.stats["sent_messages"] += 1
+                return result
+            except Exception as e:
+                if attempt >= cfg.send_retries:
+                    raise
+                delay = cfg.send_retry_backoff * (2 ** attempt)
+                attempt += 1
+                self.stats["send_retries"] += 1
+                logger.warning(f"消息发送失败，{delay:.1f}s 后重试（第 {attempt} 次）: {e}")
+                await asyncio.sleep(delay)
+
+    async def _throttle(self, cfg: ManagerConfig, key: str, bot_id: str) -> None:
+        now = time.monotonic()
+        target = self.target_buckets.get(key)
+        if target is None:
+            target = self.target_buckets[key] = TokenBucket(cfg.send_target_burst)
+        bot_bucket = self.bot_buckets.get(bot_id)
+        if bot_bucket is None:
+            bot_bucket = self.bot_buckets[bot_id] = TokenBucket(cfg.send_bot_burst)
+        delay = max(
+            target.reserve(cfg.send_target_rate, cfg.send_target_burst, now),
+            bot_bucket.reserve(cfg.send_bot_rate, cfg.send_bot_burst, now),
+        )
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @property
+    def pending(self) -> int:
+        return sum(len(lane.jobs) + (lane.runner is not None) for lane in self.lanes.values())
+
+    async def drain(self, timeout: float) -> None:
+        """关闭前等待队列中的消息发完；超时后取消发送，未发出的回复以空结果结束"""
+        runners = {lane.runner for lane in self.lanes.values() if lane.runner is not None}
+        if runners:
+            _, pending = await asyncio.wait(runners, timeout=timeout)
+            for runner in pending:
+                _ = runner.cancel()
+            if pending:
+                _ = await asyncio.wait(pending)
+        # 尚未开始运行就被取消的协程不会进入 _run_lane 的清理逻辑
+        for lane in self.lanes.values():
+            self._abandon(lane)
+        self.lanes.clear()
+
+
+dispatcher = OutboundDispatcher()
+
+__all__ = ["OutboundDispatcher", "OutgoingMessage", "TokenBucket", "dispatcher", "split_message", "target_key"]
+# fmt: on
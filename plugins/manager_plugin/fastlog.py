@@ -0,0 +1,134 @@
+# fastlog.py
+# fmt: off
+"""
+热路径日志
+- 先按 log_level 判断再格式化：NoneBot 默认处理器的 level 为 0、在过滤器里才比较等级，
+  被过滤掉的 debug 日志依旧要完成 f-string 拼接和日志记录构造，这里提前短路
+- 按类别采样：繁忙群里的高频日志只记录一部分
+- 异步模式：控制台输出改为队列 + 后台线程写入，另可输出按大小轮转的 JSON 行日志
+"""
+from __future__ import annotations
+
+import sys
+
+from nonebot import get_driver
+from nonebot.log import default_filter, default_format, logger
+
+LOG_MODES = ("sync", "async")
+
+
+def _level_no(level: str | int) -> int:
+    if isinstance(level, int):
+        return level
+    try:
+        return logger.level(level.upper()).no
+    except ValueError:
+        return logger.level("INFO").no
+
+
+class FastLogger:
+    """带等级短路与按类别采样的日志记录器；消息模板使用 loguru 的 {} 格式，字段同时写入 extra"""
+
+    threshold: int
+    sample_every: dict[str, int]   # 类别 -> 每 N 条记录 1 条
+    _counters: dict[str, int]
+    _handler_ids: list[int]
+    mode: str
+
+    def __init__(self) -> None:
+        try:
+            self.threshold = _level_no(get_driver().config.log_level)
+        except ValueError:
+            # 尚未初始化 NoneBot（例如单独导入本模块）
+            self.threshold = 0
+        self.sample_every = {}
+        self._counters = {}
+        self._handler_ids = []
+        self.mode = "sync"
+
+    def set_sample_rates(self, rates: dict[str, float]) -> None:
+        """采样率 0~1，1 为全部记录，0 为全部丢弃"""
+        sample_every: dict[str, int] = {}
+        for category, rate in rates.items():
+            if rate >= 1:
+                continue
+            sample_every[category] = 0 if rate <= 0 else max(round(1 / rate), 1)
+        self.sample_every = sample_every
+        self._counters = {}
+
+    def enabled(self, level: int, category: str) -> bool:
+        if level < self.threshold:
+            return False
+        every = self.sample_every.get(category)
+        if every is None:
+            return True
+        if every == 0:
+            return False
+        count = self._counters.get(category, 0)
+        self._counters[category] = count + 1
+        return count % every == 0
+
+    def debug(self, category: str, message: str, **fields: object) -> None:
+        if self.enabled(10, category):
+            logger.opt(depth=1).debug(message, category=category, **fields)
+
+    def info(self, category: str, message: str, **fields: object) -> None:
+        if self.enabled(20, category):
+            logger.opt(depth=1).info(message, category=category, **fields)
+
+    # ---------- 处理器 ----------
+    def configure(
+        self,
+        mode: str,
+        json_path: str = "",
+        rotation: str = "20 MB",
+        retention: int = 5,
+    ) -> None:
+        """切换输出模式；可重复调用（重新加载配置时）"""
+        self.remove_handlers()
+        if mode != self.mode:
+            import nonebot.log as nonebot_log
+            # 用同样的格式与过滤器替换 NoneBot 默认处理器，异步模式下写入改由后台线程完成
+            try:
+                logger.remove(nonebot_log.logger_id)
+            except ValueError:
+                pass
+            nonebot_log.logger_id = logger.add(
+                sys.stdout,
+                level=0,
+                diagnose=False,
+                filter=default_filter,
+                format=default_format,
+                enqueue=mode == "async",
+            )
+            self.mode = mode
+        if json_path:
+            self._handler_ids.append(logger.add(
+                json_path,
+                level=0,
+                diagnose=False,
+                filter=default_filter,
+                serialize=True,
+                enqueue=mode == "async",
+                rotation=rotation,
+                retention=retention,
+                encoding="utf-8",
+            ))
+
+    def remove_handlers(self) -> None:
+        for handler_id in self._handler_ids:
+            try:
+                logger.remove(handler_id)
+            except ValueError:
+                pass
+        self._handler_ids = []
+
+    async def complete(self) -> None:
+        """等待队列中的日志全部写出"""
+        await logger.complete()
+
+
+fastlog = FastLogger()
+
+__all__ = ["LOG_MODES", "FastLogger", "fastlog"]
+# fmt: on
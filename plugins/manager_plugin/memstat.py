@@ -0,0 +1,128 @@
+# memstat.py
+# fmt: off
+"""
+内存占用估算
+sizeof() 递归统计内置容器与 __slots__ 记录（上下文、令牌桶等都是这类结构），numpy 数组按数据大小计；
+其他对象（Future、Bot、事件等）只计对象本身，不顺着引用走，避免把整个事件循环算进来。
+结果是估算值：不含分配器碎片与解释器自身开销，只用于比较各子系统的相对大小与增长趋势。
+AllocationTracker 按需开启 tracemalloc，对比两次快照之间各代码行新增的分配；开启期间所有分配都有额外开销
+"""
+from __future__ import annotations
+
+import importlib
+import os
+import sys
+import tracemalloc
+from collections import deque
+from typing import cast
+
+_CONTAINERS = (list, tuple, set, frozenset, deque)
+
+
+def _slot_names(cls: type) -> list[str]:
+    names: list[str] = []
+    for klass in cls.__mro__:
+        slots: object = klass.__dict__.get("__slots__", ())
+        if isinstance(slots, str):
+            names.append(slots)
+        else:
+            names.extend(cast(tuple[str, ...], slots))
+    return names
+
+
+def sizeof(obj: object, seen: set[int] | None = None) -> int:
+    """对象及其持有的容器、__slots__ 记录的总字节数；seen 用于在多次调用间去重共享对象"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    nbytes: object = getattr(obj, "nbytes", None)
+    if isinstance(nbytes, int) and hasattr(obj, "dtype"):
+        # numpy 数组：视图与内存映射的 getsizeof 不含数据部分
+        return max(size, nbytes)
+    if isinstance(obj, dict):
+        for key, value in cast(dict[object, object], obj).items():
+            size += sizeof(key, seen) + sizeof(value, seen)
+    elif isinstance(obj, _CONTAINERS):
+        for item in cast("list[object]", obj):
+            size += sizeof(item, seen)
+    elif not hasattr(obj, "__dict__"):
+        for name in _slot_names(type(obj)):
+            attr: object = getattr(obj, name, None)
+            if attr is not None:
+                size += sizeof(attr, seen)
+    return size
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def process_rss() -> int | None:
+    """当前进程的常驻内存（需要 psutil），未安装时返回 None"""
+    try:
+        psutil = importlib.import_module("psutil")
+    except ImportError:
+        return None
+    info: object = psutil.Process().memory_info()
+    return int(cast(int, getattr(info, "rss", 0)))
+
+
+class AllocationTracker:
+    """tracemalloc 快照对比：第一次调用开始追踪并记录基线，之后每次调用返回相对上一次快照增长最多的代码行"""
+
+    baseline: tracemalloc.Snapshot | None
+
+    def __init__(self) -> None:
+        self.baseline = None
+
+    @property
+    def active(self) -> bool:
+        return self.baseline is not None and tracemalloc.is_tracing()
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def diff(self, limit: int) -> list[str]:
+        if not self.active:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.baseline = self._snapshot()
+            return ["已开始追踪内存分配，稍后再次执行查看增长最多的代码行"]
+        baseline = cast(tracemalloc.Snapshot, self.baseline)
+        current = self._snapshot()
+        self.baseline = current
+        stats = [s for s in current.compare_to(baseline, "lineno") if s.size_diff > 0][:limit]
+        traced, peak = tracemalloc.get_traced_memory()
+        lines = [f"追踪中的分配: {format_bytes(traced)}（峰值 {format_bytes(peak)}），自上次快照增长最多:"]
+        cwd = os.getcwd()
+        for stat in stats:
+            frame = stat.traceback[0]
+            filename = os.path.relpath(frame.filename, cwd) if frame.filename.startswith(cwd) else frame.filename
+            lines.append(f"   • {filename}:{frame.lineno} {format_bytes(stat.size_diff)}（{stat.count_diff:+} 块）")
+        if not stats:
+            lines.append("   • 无增长")
+        return lines
+
+    def stop(self) -> None:
+        self.baseline = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+allocation_tracker = AllocationTracker()
+
+__all__ = ["AllocationTracker", "allocation_tracker", "format_bytes", "process_rss", "sizeof"]
+# fmt: on
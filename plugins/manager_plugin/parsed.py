@@ -0,0 +1,92 @@
+# parsed.py
+# fmt: off
+"""
+单次解析的消息视图
+同一事件只遍历一次消息段，结果缓存在事件 state 中供各插件共享
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import cast
+
+from nonebot.adapters import Bot as BaseBot, Event
+from nonebot.typing import T_State
+
+PARSED_MESSAGE_KEY = "_parsed_message"
+
+
+@dataclass(slots=True)
+class ParsedMessage:
+    """一条入站消息的解析结果"""
+
+    plaintext: str
+    stripped: str
+    at_bot: bool          # 消息段中 @ 了机器人（QQ mention / OneBot at）
+    cq_at_bot: bool       # 纯文本中包含 @ 机器人的 CQ 码
+    is_private: bool
+    # 昵称命中由 chat_plugin 按需填充，每个事件只计算一次
+    nickname_checked: bool = False
+    nickname: str | None = None
+    nickname_span: tuple[int, int] | None = None
+    actual_text: str | None = None
+
+
+@lru_cache(maxsize=64)
+def cq_at_code(bot_id: str) -> str:
+    """@ 机器人的 CQ 码（按 bot_id 缓存，避免每条消息重建 f-string）"""
+    return f"[CQ:at,qq={bot_id}]"
+
+
+def _seg_data_get(seg: object, key: str) -> object:
+    """安全地从消息段的 data 字典中取值，消除 seg.data.get() 的类型未知问题"""
+    raw_data = getattr(seg, "data", {})
+    if not isinstance(raw_data, dict):
+        return None
+    d = cast(dict[str, object], raw_data)
+    return d.get(key)
+
+
+def parse_message(bot: BaseBot, event: Event) -> ParsedMessage | None:
+    """遍历一次消息段，同时提取纯文本与 @ 信息；非消息事件返回 None"""
+    try:
+        message = event.get_message()
+    except (ValueError, NotImplementedError):
+        return None
+
+    bot_id = bot.self_id
+    parts: list[str] = []
+    at_bot = False
+    for seg in message:
+        seg_type: object = getattr(seg, "type", None)
+        if seg_type == "text":
+            # str(seg) 在 OneBot V11 上返回转义后的 CQ 文本（& → &amp;、[ → &#91;），这里取原文
+            text = _seg_data_get(seg, "text")
+            if isinstance(text, str):
+                parts.append(text)
+        elif seg_type == "at":
+            at_bot = at_bot or _seg_data_get(seg, "qq") == bot_id
+        elif seg_type == "mention":
+            at_bot = at_bot or _seg_data_get(seg, "user_id") == bot_id
+
+    plaintext = "".join(parts)
+    return ParsedMessage(
+        plaintext=plaintext,
+        stripped=plaintext.strip(),
+        at_bot=at_bot,
+        cq_at_bot=cq_at_code(bot_id) in plaintext,
+        is_private=getattr(event, "message_type", None) == "private",
+    )
+
+
+def get_parsed_message(bot: BaseBot, event: Event, state: T_State) -> ParsedMessage | None:
+    """获取事件的解析结果，首次调用时解析并缓存到 state"""
+    if PARSED_MESSAGE_KEY in state:
+        return cast("ParsedMessage | None", state[PARSED_MESSAGE_KEY])
+    parsed = parse_message(bot, event)
+    state[PARSED_MESSAGE_KEY] = parsed
+    return parsed
+
+
+__all__ = ["ParsedMessage", "cq_at_code", "get_parsed_message", "parse_message"]
+# fmt: on
@@ -0,0 +1,71 @@
+# profiler.py
+# fmt: off
+"""
+启动耗时统计
+记录各插件导入/初始化耗时，在第一个机器人连接时输出 boot-to-ready 报告
+"""
+from __future__ import annotations
+
+import sys
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from nonebot.log import logger
+
+
+def _read_boot_time() -> float:
+    """bot.py 在导入 nonebot 之前记录的启动时间戳（__main__.BOOT_TIME）；未经 bot.py 启动时以本模块导入时间为准"""
+    boot_time: object = getattr(sys.modules.get("__main__"), "BOOT_TIME", None)
+    if isinstance(boot_time, float):
+        return boot_time
+    return time.time()
+
+
+class StartupProfiler:
+    """启动阶段耗时记录器"""
+
+    boot_time: float
+    records: list[tuple[str, str, float]]  # (插件名, 阶段, 秒)
+    ready_time: float | None
+
+    def __init__(self) -> None:
+        self.boot_time = _read_boot_time()
+        self.records = []
+        self.ready_time = None
+
+    def record(self, plugin: str, phase: str, seconds: float) -> None:
+        self.records.append((plugin, phase, seconds))
+        logger.debug(f"[startup] {plugin}.{phase}: {seconds * 1000:.1f}ms")
+
+    @contextmanager
+    def measure(self, plugin: str, phase: str) -> Iterator[None]:
+        """统计代码块耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(plugin, phase, time.perf_counter() - start)
+
+    def mark_ready(self) -> float | None:
+        """标记就绪并输出报告；只有第一次调用生效，返回 boot-to-ready 秒数"""
+        if self.ready_time is not None:
+            return None
+        self.ready_time = time.time()
+        elapsed = self.ready_time - self.boot_time
+        logger.info("\n".join(self.report_lines()))
+        return elapsed
+
+    def report_lines(self) -> list[str]:
+        lines = ["启动耗时报告"]
+        for plugin, phase, seconds in sorted(self.records, key=lambda r: r[2], reverse=True):
+            lines.append(f"   • {plugin}.{phase}: {seconds * 1000:.1f}ms")
+        if self.ready_time is not None:
+            lines.append(f"   • boot-to-ready: {self.ready_time - self.boot_time:.2f}s")
+        return lines
+
+
+startup_profiler = StartupProfiler()
+
+__all__ = ["StartupProfiler", "startup_profiler"]
+# fmt: on
@@ -0,0 +1,62 @@
+# shard.py
+# fmt: off
+"""
+多 worker 分片
+多个进程同时连接同一账号时，每个事件按分片键的哈希只由一个 worker 处理；
+分片键默认取群号（私聊取用户ID），聊天插件会注册与上下文归属一致的分片键，保证同一上下文总落在同一个 worker。
+只连接到部分 worker 的账号（各 worker 连接不同账号）不能分片，否则哈希到其他 worker 的事件无人处理：
+配置了 shard_bots 时只有其中的账号参与分片，其余账号的事件由收到它的 worker 处理
+"""
+from __future__ import annotations
+
+import zlib
+from collections.abc import Callable, Collection
+
+from nonebot.adapters import Event
+
+ShardKeyFunc = Callable[[Event], "str | None"]
+
+
+def default_shard_key(event: Event) -> str | None:
+    """群消息按群分片，私聊按用户分片；没有用户的事件（心跳、生命周期等）不分片"""
+    for attr in ("group_id", "group_openid"):
+        group_id: object = getattr(event, attr, None)
+        if group_id is not None:
+            return f"group_{group_id}"
+    try:
+        return event.get_user_id()
+    except (ValueError, NotImplementedError):
+        return None
+
+
+_shard_key: ShardKeyFunc = default_shard_key
+
+
+def set_shard_key(func: ShardKeyFunc) -> None:
+    """注册分片键函数（聊天插件按 context_scope 注册）"""
+    global _shard_key
+    _shard_key = func
+
+
+def shard_of(key: str, worker_count: int) -> int:
+    return zlib.crc32(key.encode("utf-8")) % worker_count
+
+
+def owns_event(
+    event: Event,
+    worker_id: int,
+    worker_count: int,
+    bot_id: str | None = None,
+    shard_bots: Collection[str] | None = None,
+) -> bool:
+    """事件是否由当前 worker 处理；shard_bots 为 None 时所有账号都参与分片"""
+    if worker_count <= 1:
+        return True
+    if shard_bots is not None and bot_id not in shard_bots:
+        return True
+    key = _shard_key(event)
+    return key is None or shard_of(key, worker_count) == worker_id
+
+
+__all__ = ["default_shard_key", "owns_event", "set_shard_key", "shard_of"]
+# fmt: on
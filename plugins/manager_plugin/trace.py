@@ -0,0 +1,131 @@
+# trace.py
+# fmt: off
+"""
+入站流量录制（可选）
+global_preprocessor 通过分片与去重检查后，把每条消息的到达时间与形态写成 JSONL 轨迹文件，供 tools/replay.py 回放压测。
+录制内容经过匿名化：用户/群 ID 做加盐哈希（盐每次启动随机生成），正文只保留“形状”（中文→字、字母→a、数字→0，
+标点与空白保留），命令只保留命令名。昵称命中位置在写出时才读取（由 chat_plugin 在同一个 ParsedMessage 上填充）
+进程重启后继续追加到同一文件时会先写一行新的文件头，回放工具把它当作新的一段接在后面
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from nonebot.adapters import Bot as BaseBot, Event
+from nonebot.log import logger
+
+from .parsed import ParsedMessage
+
+TRACE_VERSION = 1
+FLUSH_INTERVAL = 1.0
+
+
+def text_shape(text: str) -> str:
+    """只保留文本形状，去掉具体内容"""
+    out: list[str] = []
+    for c in text:
+        if c.isdigit():
+            out.append("0")
+        elif c.isascii() and c.isalpha():
+            out.append("a")
+        elif c.isalnum():
+            out.append("字")
+        else:
+            out.append(c)
+    return "".join(out)
+
+
+class TraceRecorder:
+    """缓冲录制的事件，定期追加写入轨迹文件"""
+
+    path: Path
+    started: float
+    pending: list[tuple[float, dict[str, object], ParsedMessage]]
+    recorded: int
+    _salt: bytes
+    _flusher: asyncio.Task[None] | None
+
+    def __init__(self, path: str | Path, salt: bytes | None = None) -> None:
+        self.path = Path(path)
+        self.started = time.monotonic()
+        self.pending = []
+        self.recorded = 0
+        # 每次录制随机加盐，轨迹之间无法关联出同一个用户
+        self._salt = salt if salt is not None else os.urandom(16)
+        self._flusher = None
+
+    def _anonymize(self, value: str) -> str:
+        return hashlib.blake2b(value.encode("utf-8"), key=self._salt, digest_size=6).hexdigest()
+
+    def record(self, bot: BaseBot, event: Event, parsed: ParsedMessage) -> None:
+        """在预处理器中调用，只做少量字段提取，序列化留到写出时"""
+        entry: dict[str, object] = {"a": bot.adapter.get_name()}
+        try:
+            entry["u"] = self._anonymize(event.get_user_id())
+        except (ValueError, NotImplementedError):
+            pass
+        for attr in ("group_id", "group_openid"):
+            group_id: object = getattr(event, attr, None)
+            if group_id is not None:
+                entry["g"] = self._anonymize(str(group_id))
+                break
+        stripped = parsed.stripped
+        if stripped.startswith("/"):
+            command, _, rest = stripped.partition(" ")
+            entry["x"] = f"{command} {text_shape(rest)}".rstrip()
+        else:
+            entry["x"] = text_shape(stripped)
+        if parsed.at_bot or parsed.cq_at_bot:
+            entry["at"] = 1
+        self.pending.append((time.monotonic() - self.started, entry, parsed))
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        lines: list[str] = []
+        for offset, entry, parsed in pending:
+            entry["t"] = round(offset, 4)
+            if parsed.nickname_span is not None:
+                # 昵称在 x 中的位置，回放时替换成回放环境的昵称
+                lead = len(parsed.plaintext) - len(parsed.plaintext.lstrip())
+                entry["nk"] = [parsed.nickname_span[0] - lead, parsed.nickname_span[1] - lead]
+            lines.append(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            if self.recorded == 0:
+                header = {"trace": TRACE_VERSION, "created": datetime.datetime.now().isoformat()}
+                _ = f.write(json.dumps(header) + "\n")
+            _ = f.write("\n".join(lines) + "\n")
+        self.recorded += len(lines)
+
+    def start(self) -> None:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error(f"写入轨迹文件失败: {e}")
+
+    def stop(self) -> None:
+        if self._flusher is not None:
+            _ = self._flusher.cancel()
+            self._flusher = None
+        try:
+            self.flush()
+        except OSError as e:
+            logger.error(f"写入轨迹文件失败: {e}")
+
+
+__all__ = ["TraceRecorder", "text_shape"]
+# fmt: on
@@ -1,10 +1,14 @@
 # fmt: off
 from __future__ import annotations
 
+import time
+_import_started = time.perf_counter()
+
 import datetime
+import importlib
 import platform
 import sys
-import time
+from functools import cache
 from typing import cast
 from types import ModuleType
 
@@ -13,26 +17,15 @@ from nonebot import get_adapters, get_driver, on_command, require
 from nonebot.adapters import Bot, Event
 from nonebot.log import logger
 
-# ---------- 可选依赖 ----------
-# 用小写前缀变量避免 reportConstantRedefinition（全大写视为常量，不可在 except 中重赋值）
-_psutil_available: bool
-_ping3_available: bool
-
-try:
-    import psutil  # type: ignore[import-untyped]
-    _psutil_available = True
-except ImportError:
-    psutil = None  # type: ignore[assignment]
-    _psutil_available = False
-    logger.warning("psutil 未安装，CPU/内存信息将不可用")
-
-try:
-    from ping3 import ping  # type: ignore[import-untyped, import-not-found] # pyright: ignore[reportUnknownVariableType]
-    _ping3_available = True
-except ImportError:
-    ping = None  # type: ignore[assignment]
-    _ping3_available = False
-    logger.warning("ping3 未安装，PING 信息将不可用")
+# ---------- 可选依赖（首次查询状态时才导入，不拖慢启动） ----------
+@cache
+def _optional_module(name: str) -> ModuleType | None:
+    """按需导入可选依赖，结果缓存；未安装时只警告一次"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        logger.warning(f"{name} 未安装，相关状态信息将不可用")
+        return None
 
 # ---------- 跨插件依赖 ----------
 _manager_module: ModuleType | None = None
@@ -74,6 +67,18 @@ def _get_context_count() -> int:
             pass
     return -1
 
+def _get_cluster_summary() -> str:
+    if _chat_module is None:
+        return ""
+    get_summary = getattr(_chat_module, "get_cluster_summary", None)
+    if callable(get_summary):
+        try:
+            result: object = get_summary()  # type: ignore[no-any-return]
+            return result if isinstance(result, str) else ""
+        except Exception:
+            pass
+    return ""
+
 
 # ---------- 启动时间 ----------
 driver = get_driver()
@@ -99,7 +104,8 @@ def format_uptime(seconds: float) -> str:
 
 
 def get_cpu_info() -> str:
-    if not _psutil_available or psutil is None:
+    psutil = _optional_module("psutil")
+    if psutil is None:
         return "未知 (需安装 psutil)"
     try:
         cpu: object = psutil.cpu_percent(interval=0.5)
@@ -109,7 +115,8 @@ def get_cpu_info() -> str:
 
 
 def get_ram_info() -> str:
-    if not _psutil_available or psutil is None:
+    psutil = _optional_module("psutil")
+    if psutil is None:
         return "未知 (需安装 psutil)"
     try:
         mem: object = psutil.virtual_memory()
@@ -123,30 +130,26 @@ def get_ram_info() -> str:
 
 
 def get_gpu_info() -> str:
+    pynvml = _optional_module("pynvml")
+    if pynvml is None:
+        return "未知 (需安装 pynvml)"
     try:
-        from pynvml import (  # type: ignore[import-untyped, import-not-found]  # pyright: ignore[reportMissingImports]
-            nvmlDeviceGetHandleByIndex,   # pyright: ignore[reportUnknownVariableType]
-            nvmlDeviceGetUtilizationRates,  # pyright: ignore[reportUnknownVariableType]
-            nvmlInit,   # pyright: ignore[reportUnknownVariableType]
-            nvmlShutdown,  # pyright: ignore[reportUnknownVariableType]
-        )
-        nvmlInit()  # type: ignore[no-untyped-call]
-        handle: object = cast(object, nvmlDeviceGetHandleByIndex(0))  # type: ignore[no-untyped-call]
-        util: object = cast(object, nvmlDeviceGetUtilizationRates(handle))  # type: ignore[no-untyped-call]
-        nvmlShutdown()  # type: ignore[no-untyped-call]
+        pynvml.nvmlInit()
+        handle: object = cast(object, pynvml.nvmlDeviceGetHandleByIndex(0))
+        util: object = cast(object, pynvml.nvmlDeviceGetUtilizationRates(handle))
+        pynvml.nvmlShutdown()
         gpu_util: object = getattr(util, "gpu", "未知")
         return f"GPU 使用率: {gpu_util}%"
-    except ImportError:
-        return "未知 (需安装 pynvml)"
     except Exception:
         return "未知 (无 NVIDIA 显卡或驱动问题)"
 
 
 def get_ping(host: str = "www.baidu.com") -> str:
-    if not _ping3_available or ping is None:
+    ping3 = _optional_module("ping3")
+    if ping3 is None:
         return "未知 (需安装 ping3)"
     try:
-        rtt = cast("float | None", ping(host, timeout=2))
+        rtt = cast("float | None", ping3.ping(host, timeout=2))
         if rtt is None:
             return "超时"
         return f"{rtt * 1000:.2f}ms"
@@ -178,6 +181,7 @@ async def handle_status(bot: Bot, event: Event) -> None:
 
     ctx_count = _get_context_count()
     ctx_text = f"{ctx_count} 人" if ctx_count >= 0 else "(不可用)"
+    cluster = _get_cluster_summary()
 
     nb_version: str = getattr(nonebot, "__version__", "未知")
     python_version = sys.version.split()[0]
@@ -229,6 +233,7 @@ async def handle_status(bot: Bot, event: Event) -> None:
         "• 当前会话",
         f"   • {current_target}",
         f"   • Chat_Plugin人格数: {ctx_text}",
+        *([f"   • 集群: {cluster}"] if cluster else []),
         "",
         "• 管理器配置",
         f"   • 白名单群聊: {', '.join(map(str, whitelist_groups)) or 'None'}",
@@ -236,4 +241,16 @@ async def handle_status(bot: Bot, event: Event) -> None:
         f"   • 白名单指令: {', '.join(allowed_commands) or 'None'}",
     ]
 
-    await bot.send(event, "\n".join(lines))  # pyright: ignore[reportUnknownMemberType]
+    # 经由 manager_plugin 的出站调度器限速发送，不可用时直接发送
+    text = "\n".join(lines)
+    submit = getattr(getattr(_manager_module, "dispatcher", None), "submit", None)
+    if callable(submit):
+        _ = submit(bot, event, text)
+    else:
+        await bot.send(event, text)  # pyright: ignore[reportUnknownMemberType]
+
+
+_profiler: object = getattr(_manager_module, "startup_profiler", None)
+_record = getattr(_profiler, "record", None)
+if callable(_record):
+    _ = _record("status_plugin", "import", time.perf_counter() - _import_started)
@@ -0,0 +1,318 @@
+# replay.py
+# fmt: off
+"""
+流量回放工具
+把 manager_plugin 录制的轨迹（MANAGER__TRACE_FILE）按原始节奏或加速后重新送进插件栈，
+上游大模型换成本地的桩服务（固定延迟），得到可以在两个版本之间对比的延迟、吞吐与上游调用报告。
+
+在项目根目录运行（读取同一份 .env，聊天接口地址、数据目录等由本工具覆盖）：
+    python tools/replay.py run data/trace.jsonl --speed 10 --out before.json
+    python tools/replay.py compare before.json after.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import sys
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+from typing import cast
+
+REPLY_PATTERN = re.compile(r"reply-\d+")
+BOT_ID = 10000
+
+
+# ---------- 轨迹 ----------
+def load_trace(path: Path) -> list[dict[str, object]]:
+    """读取轨迹文件；进程重启后追加的新段接在上一段末尾"""
+    events: list[dict[str, object]] = []
+    base = 0.0
+    last = 0.0
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = cast(dict[str, object], json.loads(line))
+            if "trace" in entry:
+                base = last
+                continue
+            entry["t"] = base + cast(float, entry.get("t", 0.0))
+            last = cast(float, entry["t"])
+            events.append(entry)
+    return events
+
+
+# ---------- 上游桩服务 ----------
+class StubLLM:
+    """兼容 /chat/completions 的最小 HTTP 服务：等待固定延迟后返回编号唯一的回复"""
+
+    latency: float
+    calls: int
+    sock: socket.socket
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.calls = 0
+        # 先同步绑定端口，才能在 nonebot.init() 之前写好接口地址
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+
+    @property
+    def base_url(self) -> str:
+        host, port = cast(tuple[str, int], self.sock.getsockname())
+        return f"http://{host}:{port}"
+
+    async def start(self) -> asyncio.Server:
+        return await asyncio.start_server(self._serve, sock=self.sock)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value.strip())
+                body = await reader.readexactly(length) if length else b""
+                self.calls += 1
+                reply_id = self.calls
+                await asyncio.sleep(self.latency)
+                payload = json.dumps({
+                    "choices": [{"message": {"role": "assistant", "content": f"reply-{reply_id}"}}],
+                    "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": 8},
+                }).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+# ---------- 统计 ----------
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """毫秒为单位的 p50/p90/p99/max"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {"count": len(ordered), "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": pick(1.0)}
+
+
+def numeric_items(data: dict[str, object], prefix: str = "") -> dict[str, float]:
+    """展开嵌套字典中的数值项，用于对比"""
+    result: dict[str, float] = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, bool):
+            continue
+        if isinstance(value, (int, float)):
+            result[name] = float(value)
+        elif isinstance(value, dict):
+            result.update(numeric_items(cast(dict[str, object], value), f"{name}."))
+    return result
+
+
+# ---------- 回放 ----------
+async def replay(events: list[dict[str, object]], stub: StubLLM, speed: float) -> dict[str, object]:
+    import nonebot
+    from nonebot.adapters.onebot.v11 import Adapter, Bot, GroupMessageEvent, Message, MessageSegment, PrivateMessageEvent
+    from nonebot.adapters.onebot.v11.event import Sender
+    from nonebot.message import handle_event
+
+    driver = nonebot.get_driver()
+    server = await stub.start()
+    await driver._lifespan.startup()  # pyright: ignore[reportPrivateUsage]
+
+    chat_mod = nonebot.require("chat_plugin")
+    manager_mod = nonebot.require("manager_plugin")
+    processor = getattr(chat_mod, "chat_processor")
+    nicknames = cast(list[str], getattr(chat_mod, "nicknames", None) or ["猫猫"])
+    dispatcher = getattr(manager_mod, "dispatcher")
+
+    bot = Bot(cast(Adapter, driver._adapters[Adapter.get_name()]), str(BOT_ID))  # pyright: ignore[reportPrivateUsage]
+    arrivals: dict[int, float] = {}
+    waiting_replies: dict[str, deque[float]] = {}
+    handle_times: list[float] = []
+    reply_times: list[float] = []
+    sent = 0
+
+    async def call_api(api: str, **data: object) -> object:
+        nonlocal sent
+        if api == "send_msg":
+            sent += 1
+            match = REPLY_PATTERN.search(str(data.get("message", "")))
+            queue = waiting_replies.get(match.group()) if match else None
+            if queue:
+                reply_times.append(time.perf_counter() - queue.popleft())
+            return {"message_id": 900000 + sent}
+        return {}
+
+    bot.call_api = call_api  # type: ignore[method-assign]
+
+    # 记录每条回复对应的事件到达时间，发出时据此计算端到端延迟
+    process_message = processor.process_message
+
+    async def timed_process_message(message: str, user_id: str, _bot: object, event: object) -> str:
+        result = cast(str, await process_message(message, user_id, _bot, event))
+        arrived = arrivals.get(cast(int, getattr(event, "message_id", 0)))
+        if arrived is not None:
+            waiting_replies.setdefault(result, deque()).append(arrived)
+        return result
+
+    processor.process_message = timed_process_message
+
+    user_ids: dict[str, int] = {}
+    group_ids: dict[str, int] = {}
+
+    def build_event(index: int, entry: dict[str, object]) -> GroupMessageEvent | PrivateMessageEvent:
+        user_id = user_ids.setdefault(str(entry.get("u", "")), 20000 + len(user_ids))
+        text = str(entry.get("x", ""))
+        span = entry.get("nk")
+        if isinstance(span, list) and len(cast(list[int], span)) == 2:
+            start, end = cast(list[int], span)
+            text = text[:start] + nicknames[0] + text[end:]
+        message = Message(MessageSegment.text(text))
+        if entry.get("at"):
+            message = MessageSegment.at(BOT_ID) + message
+        data: dict[str, object] = {
+            "time": int(time.time()), "self_id": BOT_ID, "post_type": "message", "sub_type": "normal",
+            "user_id": user_id, "message_id": index, "message": message, "original_message": message,
+            "raw_message": str(message), "font": 0, "sender": Sender(user_id=user_id, nickname=f"u{user_id}"),
+            "to_me": bool(entry.get("at")),
+        }
+        group = entry.get("g")
+        if group is None:
+            return PrivateMessageEvent.model_validate({**data, "message_type": "private"})
+        group_id = group_ids.setdefault(str(group), 30000 + len(group_ids))
+        return GroupMessageEvent.model_validate({**data, "message_type": "group", "group_id": group_id})
+
+    async def feed(index: int, event: GroupMessageEvent | PrivateMessageEvent) -> None:
+        started = time.perf_counter()
+        arrivals[index] = started
+        await handle_event(bot, event)
+        handle_times.append(time.perf_counter() - started)
+
+    tasks: list[asyncio.Task[None]] = []
+    wall_started = time.perf_counter()
+    for index, entry in enumerate(events, start=1):
+        delay = wall_started + cast(float, entry["t"]) / speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(feed(index, build_event(index, entry))))
+    _ = await asyncio.gather(*tasks)
+    while dispatcher.pending:
+        await asyncio.sleep(0.05)
+    wall_time = time.perf_counter() - wall_started
+
+    chat_metrics = cast(dict[str, object], processor.get_metrics())
+    manager_metrics = cast(dict[str, object], getattr(manager_mod, "get_metrics")())
+    await driver._lifespan.shutdown()  # pyright: ignore[reportPrivateUsage]
+    server.close()
+
+    return {
+        "events": len(events),
+        "speed": speed,
+        "llm_latency": stub.latency,
+        "wall_time": round(wall_time, 3),
+        "throughput": round(len(events) / wall_time, 2) if wall_time > 0 else 0.0,
+        "replies": len(reply_times),
+        "upstream_calls": stub.calls,
+        "sent_messages": sent,
+        "handle_ms": percentiles(handle_times),
+        "reply_ms": percentiles(reply_times),
+        "chat": numeric_items(chat_metrics),
+        "manager": numeric_items(manager_metrics),
+    }
+
+
+def run(args: argparse.Namespace) -> None:
+    events = load_trace(Path(args.trace))
+    if args.limit:
+        events = events[: args.limit]
+    stub = StubLLM(args.llm_latency)
+
+    import nonebot
+    from nonebot.adapters.onebot.v11 import Adapter
+
+    sys.path.insert(0, os.getcwd())
+    # 回放产生的上下文与用量写到临时目录，不影响被测环境的数据
+    with tempfile.TemporaryDirectory(prefix="replay-") as data_dir:
+        # init() 的参数与 .env 逐项合并：其余配置沿用被测环境，只替换上游、数据目录并关闭录制与分片
+        nonebot.init(
+            log_level=args.log_level,
+            chat={"api_key": "replay", "api_base": stub.base_url, "data_dir": data_dir, "storage_backend": "memory"},
+            manager={"trace_file": "", "worker_count": 1, "worker_id": 0, "config_watch_interval": 0},
+        )
+        nonebot.get_driver().register_adapter(Adapter)
+        _ = nonebot.load_plugins("./plugins")
+
+        report = asyncio.run(replay(events, stub, args.speed))
+    report["trace"] = str(args.trace)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        _ = Path(args.out).write_text(text, encoding="utf-8")
+    print(text)
+
+
+def compare(args: argparse.Namespace) -> None:
+    reports = [
+        numeric_items(cast(dict[str, object], json.loads(Path(p).read_text(encoding="utf-8"))))
+        for p in (args.base, args.head)
+    ]
+    base, head = reports
+    width = max((len(key) for key in {**base, **head}), default=10)
+    print(f"{'指标':<{width}}  {'base':>12}  {'head':>12}  {'变化':>8}")
+    for key in sorted({**base, **head}):
+        old, new = base.get(key), head.get(key)
+        delta = ""
+        if old is not None and new is not None and old != 0:
+            delta = f"{(new - old) / old:+.1%}"
+        old_text = "-" if old is None else f"{old:g}"
+        new_text = "-" if new is None else f"{new:g}"
+        print(f"{key:<{width}}  {old_text:>12}  {new_text:>12}  {delta:>8}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="回放录制的流量并生成性能报告")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="回放轨迹文件")
+    _ = run_parser.add_argument("trace", help="MANAGER__TRACE_FILE 录制的轨迹文件")
+    _ = run_parser.add_argument("--speed", type=float, default=1.0, help="回放倍速（默认 1，按原始节奏）")
+    _ = run_parser.add_argument("--llm-latency", type=float, default=0.5, help="桩服务每次回复的延迟秒数")
+    _ = run_parser.add_argument("--limit", type=int, default=0, help="只回放前 N 条事件")
+    _ = run_parser.add_argument("--log-level", default="WARNING", help="回放时的日志级别")
+    _ = run_parser.add_argument("--out", help="报告输出路径（JSON）")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = sub.add_parser("compare", help="对比两份报告")
+    _ = compare_parser.add_argument("base")
+    _ = compare_parser.add_argument("head")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
+# fmt: on